@@ -1,9 +1,16 @@
-from fastapi import FastAPI
+import os
+import time
+
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 
 from app.routes.sessions import router as sessions_router
 from app.routes.nlp import router as nlp_router
+from app.services import metrics
+
 
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0").lower() in {"1", "true", "yes"}
 
 app = FastAPI(title="Excels Web API", version="0.1.0")
 
@@ -16,10 +23,36 @@ app.add_middleware(
 )
 
 
+@app.middleware("http")
+async def record_request_timing(request: Request, call_next):
+    started = time.perf_counter()
+    with metrics.collect_timings() as timings:
+        response = await call_next(request)
+    elapsed = time.perf_counter() - started
+    route = request.scope.get("route")
+    metrics.observe(
+        "excels_request_seconds",
+        elapsed,
+        route=getattr(route, "path", "unmatched"),
+        method=request.method,
+        status=str(response.status_code),
+    )
+    if SERVER_TIMING:
+        timings.append(("total", elapsed))
+        response.headers["Server-Timing"] = metrics.server_timing_header(timings)
+        response.headers["Timing-Allow-Origin"] = "*"
+    return response
+
+
 @app.get("/health")
 def health():
     return {"ok": True}
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 app.include_router(sessions_router, prefix="/sessions", tags=["sessions"])
 app.include_router(nlp_router, prefix="/nlp", tags=["nlp"])
@@ -31,6 +31,10 @@ class Operation(BaseModel):
         "delete_rows",
         "update_cells",
         "sort",
+        "group_by",
+        "pivot",
+        "lookup",
+        "add_formula",
     ]
     sheet: Optional[str] = None
     cell: Optional[str] = None
@@ -54,6 +58,19 @@ class Operation(BaseModel):
     set: Optional[Dict[str, Any]] = None
     by: Optional[str] = None
     ascending: Optional[bool] = True
+    keys: Optional[List[str]] = None
+    values: Optional[List[str]] = None
+    aggs: Optional[List[str]] = None
+    columns: Optional[List[str]] = None
+    categorical_keys: Optional[bool] = False
+    source_sheet: Optional[str] = None
+    source_workbook: Optional[str] = None
+    on: Optional[str] = None
+    left_on: Optional[str] = None
+    right_on: Optional[str] = None
+    how: Optional[Literal["left", "inner"]] = "left"
+    duplicates: Optional[Literal["first", "last", "error"]] = "first"
+    formula: Optional[str] = None
     from_sheet: Optional[str] = Field(default=None, alias="from")
     to_sheet: Optional[str] = Field(default=None, alias="to")
 
@@ -61,6 +78,9 @@ class Operation(BaseModel):
 class ApplyOperationsRequest(BaseModel):
     message: Optional[str] = None
     operations: List[Operation]
+    dry_run: bool = False
+    limit: int = Field(default=100, ge=1, le=1000)
+    base_commit: Optional[str] = None
 
 
 class CommitSummary(BaseModel):
@@ -84,9 +104,33 @@ class AnalysisResult(BaseModel):
     df: float
 
 
+class CellChange(BaseModel):
+    row: int
+    column: str
+    before: Optional[Any] = None
+    after: Optional[Any] = None
+
+
+class SheetDiff(BaseModel):
+    sheet: str
+    status: Literal["added", "removed", "modified"]
+    added_columns: List[str]
+    removed_columns: List[str]
+    moved_columns: List[str] = []
+    row_count_before: int
+    row_count_after: int
+    added_rows: List[int]
+    removed_rows: List[int]
+    changed_rows: List[int]
+    cells: List[CellChange]
+    total_rows: int = 0
+    has_more: bool = False
+
+
 class ApplyOperationsResponse(BaseModel):
-    commit: CommitSummary
+    commit: Optional[CommitSummary] = None
     analysis: Optional[List[AnalysisResult]] = None
+    diff: Optional[List[SheetDiff]] = None
 
 
 class HistoryResponse(BaseModel):
@@ -97,6 +141,20 @@ class RollbackRequest(BaseModel):
     commit_id: str
 
 
+class DiffRequest(BaseModel):
+    base: str
+    target: Optional[str] = None
+    sheet: Optional[str] = None
+    offset: int = Field(default=0, ge=0)
+    limit: int = Field(default=1000, ge=1, le=10000)
+
+
+class DiffResponse(BaseModel):
+    base: str
+    target: str
+    sheets: List[SheetDiff]
+
+
 class BatchApplyRequest(BaseModel):
     message: Optional[str] = None
     operations: List[Operation]
@@ -110,3 +168,20 @@ class ParseRequest(BaseModel):
 class ParseResponse(BaseModel):
     message: str
     operations: List[Operation]
+
+
+class CommandRequest(BaseModel):
+    message: str
+    sheet: Optional[str] = None
+    limit: int = Field(default=100, ge=1, le=1000)
+    dry_run: bool = False
+    base_commit: Optional[str] = None
+
+
+class CommandResponse(BaseModel):
+    message: str
+    operations: List[Operation]
+    commit: Optional[CommitSummary] = None
+    analysis: Optional[List[AnalysisResult]] = None
+    diff: Optional[List[SheetDiff]] = None
+    preview: Dict[str, Any]
@@ -9,14 +9,17 @@ from app.services.zhipu import parse_to_operations
 router = APIRouter()
 
 
-@router.post("/parse", response_model=ParseResponse)
-def parse_message(payload: ParseRequest):
+def parse_request(message: str, sheet: str | None = None) -> ParseResponse:
     try:
-        parsed = parse_to_operations(payload.message, payload.sheet)
+        return parse_to_operations(message, sheet, ParseResponse.model_validate)
     except RuntimeError as exc:
         if str(exc) == "missing_api_key":
             raise HTTPException(status_code=400, detail="missing_api_key")
         raise HTTPException(status_code=502, detail="llm_error")
     except Exception:
         raise HTTPException(status_code=400, detail="parse_failed")
-    return parsed
+
+
+@router.post("/parse", response_model=ParseResponse)
+def parse_message(payload: ParseRequest):
+    return parse_request(payload.message, payload.sheet)
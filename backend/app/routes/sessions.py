@@ -1,30 +1,31 @@
 from __future__ import annotations
 
 from io import BytesIO
-from typing import List
+from typing import List, Optional
 
-import pandas as pd
 import json
 
 from fastapi import APIRouter, File, Form, HTTPException, UploadFile
 from fastapi.responses import StreamingResponse
-from openpyxl import load_workbook
-from openpyxl.formatting.rule import CellIsRule
-from openpyxl.styles import PatternFill
-from openpyxl.utils import get_column_letter
 
 from app.models.schemas import (
     ApplyOperationsRequest,
     ApplyOperationsResponse,
     BatchApplyRequest,
+    CommandRequest,
+    CommandResponse,
     CommitSummary,
     CreateEmptyWorkbookRequest,
     CreateSessionRequest,
+    DiffRequest,
+    DiffResponse,
     HistoryResponse,
     PreviewRequest,
     RollbackRequest,
 )
-from app.services import excel
+from app.routes.nlp import parse_request
+from app.services import excel, formulas, metrics
+from app.services.diff import diff_sheets
 from app.services.store import STORE
 
 
@@ -49,30 +50,36 @@ def create_empty_workbook(session_id: str, payload: CreateEmptyWorkbookRequest):
 
 
 @router.post("/{session_id}/workbooks/upload")
-def upload_workbook(session_id: str, file: UploadFile = File(...)):
+def upload_workbook(session_id: str, file: UploadFile = File(...), compact: Optional[bool] = None):
     try:
         session = STORE.get_session(session_id)
     except KeyError:
         raise HTTPException(status_code=404, detail="session_not_found")
     content = file.file.read()
-    sheets = excel.load_excel(content, file.filename)
-    STORE.add_workbook(session, file.filename or "upload.xlsx", sheets)
+    with metrics.span("load"):
+        sheets = excel.load_excel(content, file.filename, compact)
+        format_rules = excel.load_formulas(content, sheets, file.filename)
+    STORE.add_workbook(session, file.filename or "upload.xlsx", sheets, format_rules)
     return {"filename": file.filename, "sheets": list(sheets.keys())}
 
 
-@router.post("/{session_id}/workbooks/{filename}/preview")
-def preview_workbook(session_id: str, filename: str, payload: PreviewRequest):
-    try:
-        session = STORE.get_session(session_id)
-        workbook = STORE.get_workbook(session, filename)
-    except KeyError as exc:
-        raise HTTPException(status_code=404, detail=str(exc))
-    sheet_name = payload.sheet or (list(workbook.sheets.keys())[0] if workbook.sheets else "Sheet1")
-    df = workbook.sheets.get(sheet_name)
-    columns, rows = excel.preview(df, payload.limit)
+def _commit_summary(commit) -> CommitSummary:
+    return CommitSummary(
+        id=commit.id,
+        message=commit.message,
+        timestamp=commit.timestamp,
+        changed_sheets=commit.changed_sheets,
+    )
+
+
+def _preview_payload(sheets, format_rules, sheet: str | None, limit: int) -> dict:
+    sheet_name = sheet or (list(sheets.keys())[0] if sheets else "Sheet1")
+    df = sheets.get(sheet_name)
+    with metrics.span("preview"):
+        columns, rows = excel.preview(df, limit)
     rules = [
         rule
-        for rule in workbook.format_rules
+        for rule in format_rules
         if rule.get("sheet") == sheet_name and rule.get("type") == "lt"
     ]
     return {
@@ -80,11 +87,25 @@ def preview_workbook(session_id: str, filename: str, payload: PreviewRequest):
         "columns": columns,
         "rows": rows,
         "rules": rules,
+        "formulas": formulas.sheet_formulas(format_rules, sheet_name),
         "row_count": int(df.shape[0]) if df is not None else 0,
         "col_count": int(df.shape[1]) if df is not None else 0,
     }
 
 
+@router.post("/{session_id}/workbooks/{filename}/preview")
+def preview_workbook(session_id: str, filename: str, payload: PreviewRequest):
+    try:
+        session = STORE.get_session(session_id)
+        workbook = STORE.get_workbook(session, filename)
+    except KeyError as exc:
+        raise HTTPException(status_code=404, detail=str(exc))
+    with workbook.lock.read():
+        result = _preview_payload(workbook.sheets, workbook.format_rules, payload.sheet, payload.limit)
+        result["head"] = workbook.head.id if workbook.head else None
+    return result
+
+
 @router.post("/{session_id}/workbooks/{filename}/operations", response_model=ApplyOperationsResponse)
 def apply_operations(session_id: str, filename: str, payload: ApplyOperationsRequest):
     try:
@@ -93,20 +114,87 @@ def apply_operations(session_id: str, filename: str, payload: ApplyOperationsReq
     except KeyError as exc:
         raise HTTPException(status_code=404, detail=str(exc))
     ops = [op.model_dump(by_alias=True) for op in payload.operations]
+    if payload.dry_run:
+        with workbook.lock.read():
+            try:
+                sheets, _format_rules, _changed_sheets, analysis = _stage_operations(workbook, ops, session)
+            except ValueError as exc:
+                raise HTTPException(status_code=400, detail=str(exc))
+            with metrics.span("diff"):
+                diff = diff_sheets(workbook.sheets, sheets, payload.limit)
+        return {"commit": None, "analysis": analysis, "diff": diff}
+    with workbook.lock.write():
+        _check_base_commit(workbook, payload.base_commit)
+        try:
+            sheets, format_rules, changed_sheets, analysis = _stage_operations(workbook, ops, session)
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=str(exc))
+        commit = STORE.publish(workbook, sheets, format_rules, payload.message or "update", changed_sheets)
+    return {"commit": _commit_summary(commit), "analysis": analysis}
+
+
+def _check_base_commit(workbook, base_commit: str | None) -> None:
+    # Optimistic check for clients that edited against a known version;
+    # must be called while holding the workbook's write lock.
+    if base_commit and (workbook.head is None or workbook.head.id != base_commit):
+        raise HTTPException(status_code=409, detail="commit_conflict")
+
+
+def _stage_operations(workbook, ops, session=None):
+    # Ops run against a shallow view of the workbook; nothing is visible on
+    # the live state until the caller publishes, so a failing op leaves the
+    # workbook at its last commit.
+    sheets = dict(workbook.sheets)
+    format_rules = [rule.copy() for rule in workbook.format_rules]
+
+    def resolve(filename):
+        if filename == workbook.filename:
+            return sheets
+        # Other workbooks are read without their lock: published sheets are
+        # immutable and swapped in whole, and taking a second lock here
+        # could deadlock two workbooks looking each other up.
+        other = session.workbooks.get(filename) if session is not None else None
+        return other.sheets if other is not None else None
+
+    with metrics.span("apply"):
+        changed_sheets, analysis = excel.apply_operations(sheets, ops, format_rules, resolve)
+    return sheets, format_rules, changed_sheets, analysis
+
+
+@router.post("/{session_id}/workbooks/{filename}/command", response_model=CommandResponse)
+def run_command(session_id: str, filename: str, payload: CommandRequest):
     try:
-    changed_sheets, analysis = excel.apply_operations(workbook.sheets, ops, workbook.format_rules)
-    except ValueError as exc:
-        raise HTTPException(status_code=400, detail=str(exc))
-    commit = STORE.commit(workbook, payload.message or "update", changed_sheets)
+        session = STORE.get_session(session_id)
+        workbook = STORE.get_workbook(session, filename)
+    except KeyError as exc:
+        raise HTTPException(status_code=404, detail=str(exc))
+    with metrics.span("parse"):
+        parsed = parse_request(payload.message, payload.sheet)
+    ops = [op.model_dump(by_alias=True) for op in parsed.operations]
+    commit = None
+    diff = None
+    lock = workbook.lock.read() if payload.dry_run else workbook.lock.write()
+    with lock:
+        if not payload.dry_run:
+            _check_base_commit(workbook, payload.base_commit)
+        try:
+            sheets, format_rules, changed_sheets, analysis = _stage_operations(workbook, ops, session)
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=str(exc))
+        if payload.dry_run:
+            with metrics.span("diff"):
+                diff = diff_sheets(workbook.sheets, sheets, payload.limit)
+        else:
+            commit = _commit_summary(
+                STORE.publish(workbook, sheets, format_rules, parsed.message or "update", changed_sheets)
+            )
     return {
-        "commit": CommitSummary(
-            id=commit.id,
-            message=commit.message,
-            timestamp=commit.timestamp,
-            changed_sheets=commit.changed_sheets,
-        )
-        ,
+        "message": parsed.message,
+        "operations": parsed.operations,
+        "commit": commit,
         "analysis": analysis,
+        "diff": diff,
+        "preview": _preview_payload(sheets, format_rules, payload.sheet, payload.limit),
     }
 
 
@@ -117,15 +205,8 @@ def history(session_id: str, filename: str):
         workbook = STORE.get_workbook(session, filename)
     except KeyError as exc:
         raise HTTPException(status_code=404, detail=str(exc))
-    commits = [
-        CommitSummary(
-            id=commit.id,
-            message=commit.message,
-            timestamp=commit.timestamp,
-            changed_sheets=commit.changed_sheets,
-        )
-        for commit in STORE.history(workbook)
-    ]
+    with workbook.lock.read():
+        commits = [_commit_summary(commit) for commit in STORE.history(workbook)]
     return {"commits": commits}
 
 
@@ -134,16 +215,37 @@ def rollback(session_id: str, filename: str, payload: RollbackRequest):
     try:
         session = STORE.get_session(session_id)
         workbook = STORE.get_workbook(session, filename)
-        commit = STORE.rollback(workbook, payload.commit_id)
     except KeyError as exc:
         raise HTTPException(status_code=404, detail=str(exc))
+    with workbook.lock.write():
+        try:
+            commit = STORE.rollback(workbook, payload.commit_id)
+        except KeyError as exc:
+            raise HTTPException(status_code=404, detail=str(exc))
+    return {"commit": _commit_summary(commit)}
+
+
+@router.post("/{session_id}/workbooks/{filename}/diff", response_model=DiffResponse)
+def diff_commits(session_id: str, filename: str, payload: DiffRequest):
+    try:
+        session = STORE.get_session(session_id)
+        workbook = STORE.get_workbook(session, filename)
+        with workbook.lock.read():
+            base = STORE.get_commit(workbook, payload.base)
+            target = STORE.get_commit(workbook, payload.target) if payload.target else workbook.head
+    except KeyError as exc:
+        raise HTTPException(status_code=404, detail=str(exc))
+    before = base.snapshot
+    after = target.snapshot
+    if payload.sheet:
+        before = {name: df for name, df in before.items() if name == payload.sheet}
+        after = {name: df for name, df in after.items() if name == payload.sheet}
+    with metrics.span("diff"):
+        sheet_diffs = diff_sheets(before, after, payload.limit, payload.offset)
     return {
-        "commit": CommitSummary(
-            id=commit.id,
-            message=commit.message,
-            timestamp=commit.timestamp,
-            changed_sheets=commit.changed_sheets,
-        )
+        "base": base.id,
+        "target": target.id,
+        "sheets": sheet_diffs,
     }
 
 
@@ -157,50 +259,17 @@ def export_workbook(session_id: str, filename: str, format: str = "xlsx"):
     format = format.lower()
     if format not in {"xlsx", "csv"}:
         raise HTTPException(status_code=400, detail="invalid_format")
+    # Published frames are never edited in place, so the export can run on
+    # the references captured under the lock without blocking writers.
+    with workbook.lock.read():
+        sheets = workbook.sheets
+        format_rules = list(workbook.format_rules)
     if format == "csv":
-        sheet_name = list(workbook.sheets.keys())[0] if workbook.sheets else "Sheet1"
-        df = workbook.sheets.get(sheet_name, pd.DataFrame())
-        content = df.to_csv(index=False).encode("utf-8")
+        with metrics.span("export"):
+            content = excel.export_csv(sheets)
         return StreamingResponse(BytesIO(content), media_type="text/csv")
-    buffer = BytesIO()
-    with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
-        for name, df in workbook.sheets.items():
-            df.to_excel(writer, sheet_name=name, index=False)
-    buffer.seek(0)
-    if workbook.format_rules:
-        wb = load_workbook(buffer)
-        for rule in workbook.format_rules:
-            sheet_name = rule.get("sheet")
-            if sheet_name not in wb.sheetnames:
-                continue
-            ws = wb[sheet_name]
-            header_cells = list(ws.iter_rows(min_row=1, max_row=1, values_only=True))[0]
-            if not header_cells:
-                continue
-            try:
-                col_idx = header_cells.index(rule.get("column")) + 1
-            except ValueError:
-                continue
-            col_letter = get_column_letter(col_idx)
-            if rule.get("type") == "number_format":
-                number_format = rule.get("format") or "0.0"
-                for cell in ws[f"{col_letter}2": f"{col_letter}{ws.max_row}"]:
-                    for c in cell:
-                        c.number_format = number_format
-            elif rule.get("type") == "lt":
-                threshold = rule.get("threshold")
-                color = rule.get("color") or "red"
-                if threshold is None:
-                    continue
-                fill = PatternFill(start_color="FFC7CE" if color == "red" else "FFFDE68A", end_color="FFC7CE" if color == "red" else "FFFDE68A", fill_type="solid")
-                ws.conditional_formatting.add(
-                    f"{col_letter}2:{col_letter}{ws.max_row}",
-                    CellIsRule(operator="lessThan", formula=[str(threshold)], fill=fill),
-                )
-        out = BytesIO()
-        wb.save(out)
-        out.seek(0)
-        buffer = out
+    with metrics.span("export"):
+        buffer = excel.export_xlsx(sheets, format_rules)
     return StreamingResponse(
         buffer,
         media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
@@ -212,6 +281,7 @@ def batch_apply(
     session_id: str,
     payload: str = Form(...),
     files: List[UploadFile] = File(...),
+    compact: Optional[bool] = None,
 ):
     try:
         session = STORE.get_session(session_id)
@@ -224,11 +294,17 @@ def batch_apply(
     results = []
     for file in files:
         content = file.file.read()
-        sheets = excel.load_excel(content, file.filename)
-        workbook = STORE.add_workbook(session, file.filename or "upload.xlsx", sheets)
+        with metrics.span("load"):
+            sheets = excel.load_excel(content, file.filename, compact)
+            format_rules = excel.load_formulas(content, sheets, file.filename)
+        workbook = STORE.add_workbook(session, file.filename or "upload.xlsx", sheets, format_rules)
         ops = [op.model_dump(by_alias=True) for op in payload_obj.operations]
-        changed_sheets, _analysis = excel.apply_operations(workbook.sheets, ops, workbook.format_rules)
-        commit = STORE.commit(workbook, payload_obj.message or "batch", changed_sheets)
+        with workbook.lock.write():
+            try:
+                staged, format_rules, changed_sheets, _analysis = _stage_operations(workbook, ops, session)
+            except ValueError as exc:
+                raise HTTPException(status_code=400, detail=f"{workbook.filename}:{exc}")
+            commit = STORE.publish(workbook, staged, format_rules, payload_obj.message or "batch", changed_sheets)
         results.append(
             {
                 "filename": workbook.filename,
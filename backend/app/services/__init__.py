@@ -1 +1,7 @@
-__all__ = ["excel", "store", "zhipu"]
+import pandas as pd
+
+# Sheets are shared between the live workbook, staged edits and commit
+# snapshots; copy-on-write keeps shallow copies independent.
+pd.set_option("mode.copy_on_write", True)
+
+__all__ = ["columnar", "diff", "excel", "formulas", "lookup", "metrics", "store", "zhipu"]
@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import logging
+import os
+from functools import lru_cache
+from typing import Dict, Iterable, List
+from uuid import uuid4
+
+import numpy as np
+import pandas as pd
+
+from app.services import metrics
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+
+DEFAULT_MIN_CELLS = 1_000_000
+
+logger = logging.getLogger(__name__)
+
+
+def enabled() -> bool:
+    if not os.getenv("EXCELS_MMAP_DIR"):
+        return False
+    if pa is None:
+        _warn_disabled("pyarrow is not installed")
+        return False
+    # Mapped files are unlinked as soon as they are mapped, which only
+    # POSIX allows; elsewhere they could never be removed.
+    if os.name != "posix":
+        _warn_disabled("it needs a POSIX system")
+        return False
+    return True
+
+
+def spill_sheets(sheets: Dict[str, pd.DataFrame], changed: Iterable[str] | None = None) -> Dict[str, pd.DataFrame]:
+    """Move large sheets onto memory-mapped Arrow files.
+
+    Only sheets named in changed (all when None) are looked at; the rest
+    were spilled when they were published. Sheets that are small, or whose
+    columns are all mapped already, come back as the same objects, so
+    snapshots keep sharing them.
+    """
+    if not enabled():
+        return sheets
+    changed = set(sheets) if changed is None else set(changed)
+    return {name: spill(df) if name in changed else df for name, df in sheets.items()}
+
+
+def spill(df: pd.DataFrame, directory: str | None = None, min_cells: int | None = None) -> pd.DataFrame:
+    """Return df with its heap columns backed by a memory-mapped file.
+
+    Only columns that pandas can read back zero-copy are spilled: numbers,
+    datetimes, text (as string[pyarrow]) and categoricals. Columns that are
+    already mapped, e.g. the untouched columns of an edited sheet, are not
+    written again.
+    """
+    directory = directory or os.getenv("EXCELS_MMAP_DIR")
+    if min_cells is None:
+        min_cells = int(os.getenv("EXCELS_MMAP_MIN_CELLS", DEFAULT_MIN_CELLS))
+    if pa is None or os.name != "posix" or not directory or df.size < min_cells or not df.columns.is_unique:
+        return df
+    arrays = {}
+    for col in df.columns:
+        series = df[col]
+        if _is_mapped(series):
+            continue
+        array = _to_arrow(series)
+        if array is not None:
+            arrays[str(col)] = (col, array)
+    if not arrays:
+        return df
+
+    with metrics.span("spill"):
+        table = pa.table({key: array for key, (_col, array) in arrays.items()})
+        mapped = _map_table(table, directory)
+        result = df.copy(deep=False)
+        for key, (col, _array) in arrays.items():
+            result[col] = mapped[key].set_axis(df.index)
+    metrics.inc("excels_spill_bytes_total", table.nbytes)
+    return result
+
+
+def mapped_columns(df: pd.DataFrame) -> List[str]:
+    return [col for col in df.columns if _is_mapped(df[col])]
+
+
+@lru_cache(maxsize=None)
+def _warn_disabled(reason: str) -> None:
+    logger.warning("EXCELS_MMAP_DIR is set but memory-mapped storage is off: %s", reason)
+
+
+def _map_table(table: "pa.Table", directory: str) -> pd.DataFrame:
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{uuid4().hex}.arrow")
+    # Uncompressed Arrow IPC, so buffers can be used straight off the map.
+    with pa.OSFile(path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    source = pa.memory_map(path)
+    mapped = pa.ipc.open_file(source).read_all()
+    # The mapping outlives the directory entry; the pages are released once
+    # the last frame using them is collected.
+    os.unlink(path)
+    return mapped.to_pandas(split_blocks=True, types_mapper=_types_mapper)
+
+
+def _types_mapper(arrow_type):
+    if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+        return pd.StringDtype("pyarrow")
+    return None
+
+
+def _to_arrow(series: pd.Series):
+    dtype = series.dtype
+    try:
+        if isinstance(dtype, pd.StringDtype) and dtype.storage == "pyarrow":
+            return series.array.__arrow_array__()
+        if isinstance(dtype, pd.CategoricalDtype):
+            return pa.Array.from_pandas(series)
+        if isinstance(dtype, np.dtype) and dtype.kind in "iuf":
+            # NaN stays a value rather than a null so floats map back zero-copy.
+            return pa.array(series.to_numpy(), from_pandas=False)
+        if isinstance(dtype, np.dtype) and dtype.kind == "M" and dtype == np.dtype("datetime64[ns]"):
+            # Same for NaT, which is just the smallest int64.
+            return pa.array(series.to_numpy().view(np.int64)).view(pa.timestamp("ns"))
+        if dtype == object:
+            array = pa.array(series.to_numpy(), from_pandas=True)
+            # string[pyarrow] holds large_string; anything else would be
+            # cast, and so copied, on the way back.
+            if pa.types.is_string(array.type) or pa.types.is_large_string(array.type):
+                return array.cast(pa.large_string())
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        return None
+    return None
+
+
+def _is_mapped(series: pd.Series) -> bool:
+    # Zero-copy numpy columns hang off a capsule owned by pyarrow, and
+    # buffers read from a memory map are immutable; heap data is neither.
+    values = series.array
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return _is_mapped_ndarray(values.codes)
+    if hasattr(values, "__arrow_array__"):
+        chunks = values.__arrow_array__()
+        chunks = chunks.chunks if isinstance(chunks, pa.ChunkedArray) else [chunks]
+        buffers = [buf for chunk in chunks for buf in chunk.buffers() if buf is not None]
+        return bool(buffers) and not any(buf.is_mutable for buf in buffers)
+    if isinstance(series.dtype, np.dtype):
+        return _is_mapped_ndarray(series.to_numpy())
+    return False
+
+
+def _is_mapped_ndarray(array: np.ndarray) -> bool:
+    while isinstance(array.base, np.ndarray):
+        array = array.base
+    return array.base is not None and not isinstance(array.base, (bytes, bytearray, memoryview))
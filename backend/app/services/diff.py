@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import math
+from typing import Any, Dict, List
+
+import numpy as np
+import pandas as pd
+from pandas.api.extensions import ExtensionDtype
+
+
+def diff_sheets(
+    before: Dict[str, pd.DataFrame],
+    after: Dict[str, pd.DataFrame],
+    limit: int,
+    offset: int = 0,
+) -> List[dict]:
+    names = list(after.keys()) + [name for name in before.keys() if name not in after]
+    diffs = []
+    for name in names:
+        old = before.get(name)
+        new = after.get(name)
+        # Snapshots hold references to unchanged sheets, so shared frames
+        # are skipped without looking at their data.
+        if old is new:
+            continue
+        entry = diff_sheet(name, old, new, limit, offset)
+        if entry["status"] != "modified" or _has_changes(entry):
+            diffs.append(entry)
+    return diffs
+
+
+def diff_sheet(
+    name: str,
+    old: pd.DataFrame | None,
+    new: pd.DataFrame | None,
+    limit: int,
+    offset: int = 0,
+) -> dict:
+    if old is None:
+        status = "added"
+        old = pd.DataFrame()
+    elif new is None:
+        status = "removed"
+        new = pd.DataFrame()
+    else:
+        status = "modified"
+    old_cols = set(old.columns)
+    new_cols = set(new.columns)
+    common = [col for col in new.columns if col in old_cols]
+    old_rows = int(old.shape[0])
+    new_rows = int(new.shape[0])
+    shared_rows = min(old_rows, new_rows)
+
+    # Changed positions are found over the whole sheet, so edits outside the
+    # page still count; only cells on the page are materialized. Pages run
+    # over the changed shared rows followed by the added or removed rows.
+    changed = {}
+    for col in common:
+        positions = _changed_positions(old[col], new[col], shared_rows)
+        if len(positions):
+            changed[col] = positions
+    rows = np.unique(np.concatenate(list(changed.values()))) if changed else np.empty(0, dtype=np.intp)
+    total = len(rows) + abs(new_rows - old_rows)
+    start = min(offset, total)
+    stop = min(offset + limit, total)
+    page = rows[start:stop]
+    tail = list(range(shared_rows + max(start - len(rows), 0) + 1, shared_rows + max(stop - len(rows), 0) + 1))
+
+    cells = []
+    for col, positions in changed.items():
+        hits = positions[np.isin(positions, page)]
+        if not len(hits):
+            continue
+        before = _object_values(old[col].iloc[hits])
+        after = _object_values(new[col].iloc[hits])
+        cells.extend(
+            {
+                "row": int(pos) + 1,
+                "column": col,
+                "before": _json_value(left),
+                "after": _json_value(right),
+            }
+            for pos, left, right in zip(hits, before, after)
+        )
+    # Columns whose position among the shared columns changed (swap_columns).
+    old_common = [col for col in old.columns if col in new_cols]
+    moved = [col for col, before in zip(common, old_common) if col != before]
+    order = {col: idx for idx, col in enumerate(common)}
+    cells.sort(key=lambda cell: (cell["row"], order[cell["column"]]))
+    return {
+        "sheet": name,
+        "status": status,
+        "added_columns": [col for col in new.columns if col not in old_cols],
+        "removed_columns": [col for col in old.columns if col not in new_cols],
+        "moved_columns": moved,
+        "row_count_before": old_rows,
+        "row_count_after": new_rows,
+        "added_rows": tail if new_rows > old_rows else [],
+        "removed_rows": tail if old_rows > new_rows else [],
+        "changed_rows": (page + 1).tolist(),
+        "cells": cells,
+        "total_rows": total,
+        "has_more": stop < total,
+    }
+
+
+def _has_changes(entry: dict) -> bool:
+    return bool(
+        entry["added_columns"]
+        or entry["removed_columns"]
+        or entry["moved_columns"]
+        or entry["total_rows"]
+    )
+
+
+def _changed_positions(old: pd.Series, new: pd.Series, rows: int) -> np.ndarray:
+    # Extension arrays (text, categoricals) are shared as objects under
+    # copy-on-write, numpy columns as buffers; either way nothing changed.
+    if isinstance(old.dtype, ExtensionDtype) and old.array is new.array:
+        return np.empty(0, dtype=np.intp)
+    old = old.iloc[:rows]
+    new = new.iloc[:rows]
+    left = old.to_numpy()
+    right = new.to_numpy()
+    if _same_buffer(left, right):
+        return np.empty(0, dtype=np.intp)
+    if left.dtype == right.dtype and left.dtype.kind in "biufcmM":
+        differs = left != right
+        if left.dtype.kind in "fcmM":
+            differs &= ~(pd.isna(left) & pd.isna(right))
+    else:
+        differs = _object_values(old) != _object_values(new)
+    return np.flatnonzero(differs)
+
+
+def _same_buffer(left: np.ndarray, right: np.ndarray) -> bool:
+    # Columns untouched since the older snapshot still point at the same
+    # block under copy-on-write.
+    if left.dtype != right.dtype or left.shape != right.shape:
+        return False
+    return (
+        left.__array_interface__["data"][0] == right.__array_interface__["data"][0]
+        and left.strides == right.strides
+    )
+
+
+def _object_values(series: pd.Series) -> np.ndarray:
+    # Compare as objects with every missing marker folded to None, so NaN, NaT
+    # and pd.NA count as equal and mixed int/float columns compare by value.
+    # Converting the Series rather than its ndarray keeps datetimes and
+    # timedeltas as Timestamp/Timedelta instead of raw int64.
+    values = series.to_numpy(dtype=object, copy=True)
+    values[pd.isna(values)] = None
+    return values
+
+
+def _json_value(value: Any) -> Any:
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and (math.isnan(value) or math.isinf(value)):
+        return None
+    return value
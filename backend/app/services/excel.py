@@ -1,40 +1,146 @@
 from __future__ import annotations
 
+import os
 import re
+import time
+from datetime import datetime
 from io import BytesIO
-from typing import Any, Dict, Iterable, List, Tuple
+from typing import Any, Callable, Dict, Iterable, List, Tuple
 
 import math
 import numpy as np
 import pandas as pd
+from openpyxl import load_workbook
+from openpyxl.formatting.rule import CellIsRule
+from openpyxl.styles import PatternFill
+from openpyxl.utils import get_column_letter
 from scipy import stats
 
+from app.services import formulas, lookup, metrics
 
-CELL_RE = re.compile(r"^([A-Za-z]+)(\\d+)$")
-RC_RE = re.compile(r"^R(\\d+)C(\\d+)$", re.IGNORECASE)
-COMMA_RE = re.compile(r"^(\\d+)\\s*,\\s*(\\d+)$")
 
+CELL_RE = re.compile(r"^([A-Za-z]+)(\d+)$")
+RC_RE = re.compile(r"^R(\d+)C(\d+)$", re.IGNORECASE)
+COMMA_RE = re.compile(r"^(\d+)\s*,\s*(\d+)$")
 
-def load_excel(file_bytes: bytes, filename: str | None = None) -> Dict[str, pd.DataFrame]:
+# Categoricals only pay off for text with few distinct values.
+CATEGORY_MAX_RATIO = 0.05
+CATEGORY_MAX_UNIQUE = 10_000
+
+AGGREGATIONS = {"sum", "mean", "count", "min", "max", "median"}
+QUANTILE_RE = re.compile(r"^q(0(?:\.\d+)?|1(?:\.0+)?)$")
+
+try:
+    import pyarrow  # noqa: F401
+
+    STRING_DTYPE: str | None = "string[pyarrow]"
+except ImportError:
+    STRING_DTYPE = None
+
+
+def load_excel(file_bytes: bytes, filename: str | None = None, compact: bool | None = None) -> Dict[str, pd.DataFrame]:
+    if compact is None:
+        compact = os.getenv("COMPACT_DTYPES", "0").lower() in {"1", "true", "yes"}
     if filename and filename.lower().endswith(".csv"):
         df = pd.read_csv(BytesIO(file_bytes))
-        return {"Sheet1": _normalize_df(df)}
+        return {"Sheet1": _normalize_df(df, compact)}
     sheets = pd.read_excel(BytesIO(file_bytes), sheet_name=None, engine="openpyxl")
     normalized = {}
     for name, df in sheets.items():
-        normalized[name] = _normalize_df(df)
+        normalized[name] = _normalize_df(df, compact)
     return normalized
 
 
+def load_formulas(file_bytes: bytes, sheets: Dict[str, pd.DataFrame], filename: str | None = None) -> List[dict]:
+    # read_excel only sees cached values. Columns filled top to bottom with
+    # the same same-row formula become formula columns and are recomputed
+    # here, since files written by other tools often carry no cached values.
+    if filename and filename.lower().endswith(".csv"):
+        return []
+    wb = load_workbook(BytesIO(file_bytes), read_only=True)
+    rules: List[dict] = []
+    try:
+        for ws in wb.worksheets:
+            df = sheets.get(ws.title)
+            if df is None or df.empty:
+                continue
+            header = next(ws.iter_rows(min_row=1, max_row=1, values_only=True), ())
+            headers = {get_column_letter(idx + 1): str(value) for idx, value in enumerate(header) if value is not None}
+            first = next(ws.iter_rows(min_row=2, max_row=2, values_only=True), ())
+            found = {}
+            for idx, value in enumerate(first):
+                letter = get_column_letter(idx + 1)
+                formula = formulas.from_excel(value, headers, 2)
+                if formula is None or headers.get(letter) not in df.columns:
+                    continue
+                render = formulas.to_excel(formula, {name: col for col, name in headers.items()})
+                cells = [cell for (cell,) in ws.iter_rows(min_row=2, min_col=idx + 1, max_col=idx + 1, values_only=True)]
+                while cells and cells[-1] is None:
+                    cells.pop()
+                # Trailing rows that hold nothing but formulas are dropped
+                # by read_excel, so there may be more cells than rows.
+                if len(cells) >= len(df) and all(
+                    isinstance(cell, str) and cell.replace("$", "") == render(row)
+                    for row, cell in enumerate(cells, start=2)
+                ):
+                    found[headers[letter]] = formula
+            try:
+                order = formulas.recalculation_order(found)
+            except ValueError:
+                continue
+            for column in order:
+                # A formula we cannot evaluate stays a plain column with
+                # Excel's cached values.
+                try:
+                    df[column] = formulas.evaluate(df, found[column])
+                except ValueError:
+                    continue
+                rules.append({"type": "formula", "sheet": ws.title, "column": column, "formula": found[column]})
+    finally:
+        wb.close()
+    return rules
+
+
 def create_empty(sheet_name: str) -> Dict[str, pd.DataFrame]:
     return {sheet_name: pd.DataFrame()}
 
 
-def _normalize_df(df: pd.DataFrame) -> pd.DataFrame:
+def _normalize_df(df: pd.DataFrame, compact: bool = False) -> pd.DataFrame:
     if df is None:
         return pd.DataFrame()
     df = df.copy()
     df.columns = [str(col) for col in df.columns]
+    if compact:
+        df = compact_dtypes(df)
+    return df
+
+
+def compact_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    # Only lossless conversions; writes that no longer fit are widened again
+    # by _fit_column.
+    if not df.columns.is_unique:
+        return df
+    converted = {}
+    for col in df.columns:
+        series = df[col]
+        dtype = series.dtype
+        if pd.api.types.is_integer_dtype(dtype) and not pd.api.types.is_extension_array_dtype(dtype):
+            converted[col] = pd.to_numeric(series, downcast="integer" if dtype.kind == "i" else "unsigned")
+        elif dtype == np.float64:
+            narrow = series.astype(np.float32)
+            if np.array_equal(narrow.to_numpy(dtype=np.float64), series.to_numpy(), equal_nan=True):
+                converted[col] = narrow
+        elif dtype == object and pd.api.types.infer_dtype(series, skipna=True) == "string":
+            unique = series.nunique(dropna=True)
+            if unique <= min(CATEGORY_MAX_RATIO * len(series), CATEGORY_MAX_UNIQUE):
+                converted[col] = series.astype("category")
+            elif STRING_DTYPE is not None:
+                converted[col] = series.astype(STRING_DTYPE)
+    if not converted:
+        return df
+    df = df.copy(deep=False)
+    for col, series in converted.items():
+        df[col] = series
     return df
 
 
@@ -58,17 +164,85 @@ def _sanitize_rows(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     return rows
 
 
+def export_csv(sheets: Dict[str, pd.DataFrame]) -> bytes:
+    sheet_name = list(sheets.keys())[0] if sheets else "Sheet1"
+    df = sheets.get(sheet_name, pd.DataFrame())
+    return df.to_csv(index=False).encode("utf-8")
+
+
+def export_xlsx(sheets: Dict[str, pd.DataFrame], format_rules: List[dict] | None = None) -> BytesIO:
+    buffer = BytesIO()
+    with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
+        for name, df in sheets.items():
+            df.to_excel(writer, sheet_name=name, index=False)
+    buffer.seek(0)
+    if not format_rules:
+        return buffer
+    wb = load_workbook(buffer)
+    for rule in format_rules:
+        sheet_name = rule.get("sheet")
+        if sheet_name not in wb.sheetnames:
+            continue
+        ws = wb[sheet_name]
+        header_cells = list(ws.iter_rows(min_row=1, max_row=1, values_only=True))[0]
+        if not header_cells:
+            continue
+        try:
+            col_idx = header_cells.index(rule.get("column")) + 1
+        except ValueError:
+            continue
+        col_letter = get_column_letter(col_idx)
+        if rule.get("type") == "formula":
+            letters = {str(header): get_column_letter(idx + 1) for idx, header in enumerate(header_cells)}
+            try:
+                render = formulas.to_excel(rule["formula"], letters)
+            except (KeyError, ValueError):
+                continue
+            for row in range(2, ws.max_row + 1):
+                ws.cell(row=row, column=col_idx).value = render(row)
+        elif rule.get("type") == "number_format":
+            number_format = rule.get("format") or "0.0"
+            for cell in ws[f"{col_letter}2": f"{col_letter}{ws.max_row}"]:
+                for c in cell:
+                    c.number_format = number_format
+        elif rule.get("type") == "lt":
+            threshold = rule.get("threshold")
+            color = rule.get("color") or "red"
+            if threshold is None:
+                continue
+            fill = PatternFill(start_color="FFC7CE" if color == "red" else "FFFDE68A", end_color="FFC7CE" if color == "red" else "FFFDE68A", fill_type="solid")
+            ws.conditional_formatting.add(
+                f"{col_letter}2:{col_letter}{ws.max_row}",
+                CellIsRule(operator="lessThan", formula=[str(threshold)], fill=fill),
+            )
+    out = BytesIO()
+    wb.save(out)
+    out.seek(0)
+    return out
+
+
 def apply_operations(
     sheets: Dict[str, pd.DataFrame],
     operations: Iterable[Dict[str, Any]],
     format_rules: List[dict] | None = None,
+    workbooks: Callable[[str], Dict[str, pd.DataFrame] | None] | None = None,
 ) -> Tuple[List[str], List[dict]]:
+    # workbooks resolves another workbook's published sheets by filename for
+    # cross-workbook lookups.
     if format_rules is None:
         format_rules = []
     changed = set()
     analysis: List[dict] = []
+    owned: Dict[int, pd.DataFrame] = {}
     for op in operations:
         op_type = op.get("type")
+        started = time.perf_counter()
+        formula_sheet = None
+        if any(rule.get("type") == "formula" for rule in format_rules):
+            formula_sheet = op.get("sheet") or (list(sheets.keys())[0] if sheets else "Sheet1")
+            before = sheets.get(formula_sheet)
+            rows_before = len(before) if before is not None else 0
+            written = _written_columns(op, before)
         if op_type == "add_sheet":
             name = op.get("to") or op.get("sheet") or "Sheet"
             if name not in sheets:
@@ -80,23 +254,31 @@ def apply_operations(
             if src and dst and src in sheets:
                 sheets[dst] = sheets.pop(src)
                 changed.add(dst)
+                for rule in format_rules:
+                    if rule.get("type") == "formula" and rule.get("sheet") == src:
+                        rule["sheet"] = dst
         elif op_type == "add_column":
-            sheet = _get_sheet(sheets, op)
+            sheet = _get_sheet(sheets, op, owned)
             column_name = op.get("column_name") or op.get("column")
             value = op.get("value")
             if column_name:
                 sheet[column_name] = value
                 changed.add(_sheet_name(sheets, sheet))
         elif op_type == "rename_column":
-            sheet = _get_sheet(sheets, op)
+            sheet = _get_sheet(sheets, op, owned)
             old = op.get("column")
             new = op.get("new_name") or op.get("column_name")
             if old and new and old in sheet.columns:
                 sheet.rename(columns={old: new}, inplace=True)
                 changed.add(_sheet_name(sheets, sheet))
+                for rule in format_rules:
+                    if rule.get("type") == "formula" and rule.get("sheet") == _sheet_name(sheets, sheet):
+                        rule["formula"] = formulas.rename_column(rule["formula"], old, new)
+                        if rule.get("column") == old:
+                            rule["column"] = new
         elif op_type == "swap_columns":
             sheet_name = op.get("sheet") or (list(sheets.keys())[0] if sheets else "Sheet1")
-            sheet = _get_sheet(sheets, op)
+            sheet = _get_sheet(sheets, op, owned)
             a = op.get("column_a") or op.get("from")
             b = op.get("column_b") or op.get("to")
             idx_a = op.get("column_index_a")
@@ -106,17 +288,17 @@ def apply_operations(
                     a = sheet.columns[int(idx_a)]
                     b = sheet.columns[int(idx_b)]
                 except (ValueError, IndexError):
-                    return sorted(changed)
+                    return sorted(changed), analysis
             if a and a not in sheet.columns and isinstance(a, str) and a.isalpha():
                 try:
                     a = sheet.columns[_col_letters_to_index(a)]
                 except IndexError:
-                    return sorted(changed)
+                    return sorted(changed), analysis
             if b and b not in sheet.columns and isinstance(b, str) and b.isalpha():
                 try:
                     b = sheet.columns[_col_letters_to_index(b)]
                 except IndexError:
-                    return sorted(changed)
+                    return sorted(changed), analysis
             if a and b and a in sheet.columns and b in sheet.columns:
                 cols = list(sheet.columns)
                 ai = cols.index(a)
@@ -125,11 +307,11 @@ def apply_operations(
                 sheets[sheet_name] = sheet[cols]
                 changed.add(sheet_name)
         elif op_type == "round_column":
-            sheet = _get_sheet(sheets, op)
+            sheet = _get_sheet(sheets, op, owned)
             col = op.get("column")
             decimals = op.get("decimals", 0)
             if col in sheet.columns:
-                sheet[col] = pd.to_numeric(sheet[col], errors="coerce").round(int(decimals))
+                sheet[col] = _numeric_values(sheet[col]).round(int(decimals))
                 changed.add(_sheet_name(sheets, sheet))
                 format_rules.append(
                     {
@@ -150,15 +332,15 @@ def apply_operations(
                 )
         elif op_type == "t_test":
             sheet_name = op.get("sheet") or (list(sheets.keys())[0] if sheets else "Sheet1")
-            sheet = _get_sheet(sheets, op)
+            sheet = _get_sheet(sheets, op, owned)
             col_a = op.get("column_a")
             col_b = op.get("column_b")
             equal_var = op.get("equal_var", False)
             output = op.get("output") or "sheet"
             prefix = op.get("output_prefix") or "t_test"
             if col_a in sheet.columns and col_b in sheet.columns:
-                a = pd.to_numeric(sheet[col_a], errors="coerce").dropna()
-                b = pd.to_numeric(sheet[col_b], errors="coerce").dropna()
+                a = _numeric_values(sheet[col_a]).dropna()
+                b = _numeric_values(sheet[col_b]).dropna()
                 if len(a) > 1 and len(b) > 1:
                     t_stat, p_value = stats.ttest_ind(a, b, equal_var=bool(equal_var), nan_policy="omit")
                     if equal_var:
@@ -214,9 +396,10 @@ def apply_operations(
                             ]
                         )
                         sheets["统计结果"] = result_df
+                        _drop_formulas(format_rules, "统计结果")
                         changed.add("统计结果")
         elif op_type == "set_cell":
-            sheet = _get_sheet(sheets, op)
+            sheet = _get_sheet(sheets, op, owned)
             cell = op.get("cell")
             value = op.get("value")
             if cell:
@@ -224,10 +407,11 @@ def apply_operations(
                 _ensure_row(sheet, row_idx)
                 if col_name not in sheet.columns:
                     sheet[col_name] = None
+                _fit_column(sheet, col_name, value)
                 sheet.at[row_idx, col_name] = value
                 changed.add(_sheet_name(sheets, sheet))
         elif op_type == "set_range":
-            sheet = _get_sheet(sheets, op)
+            sheet = _get_sheet(sheets, op, owned)
             range_ref = op.get("range")
             value = op.get("value")
             if range_ref:
@@ -235,10 +419,11 @@ def apply_operations(
                     _ensure_row(sheet, row_idx)
                     if col_name not in sheet.columns:
                         sheet[col_name] = None
+                    _fit_column(sheet, col_name, value)
                     sheet.at[row_idx, col_name] = value
                 changed.add(_sheet_name(sheets, sheet))
         elif op_type == "delete_rows":
-            sheet = _get_sheet(sheets, op)
+            sheet = _get_sheet(sheets, op, owned)
             rows = op.get("rows") or []
             if rows:
                 drop_idx = [r - 1 for r in rows if r > 0]
@@ -246,7 +431,7 @@ def apply_operations(
                 sheet.reset_index(drop=True, inplace=True)
                 changed.add(_sheet_name(sheets, sheet))
         elif op_type == "update_cells":
-            sheet = _get_sheet(sheets, op)
+            sheet = _get_sheet(sheets, op, owned)
             where = op.get("where") or {}
             set_values = op.get("set") or {}
             col = where.get("column")
@@ -256,26 +441,319 @@ def apply_operations(
                 for target_col, target_val in set_values.items():
                     if target_col not in sheet.columns:
                         sheet[target_col] = None
+                    _fit_column(sheet, target_col, target_val)
                     sheet.loc[mask, target_col] = target_val
                 changed.add(_sheet_name(sheets, sheet))
         elif op_type == "sort":
-            sheet = _get_sheet(sheets, op)
+            sheet = _get_sheet(sheets, op, owned)
             by = op.get("by")
             ascending = op.get("ascending", True)
             if by in sheet.columns:
                 sheet.sort_values(by=by, ascending=ascending, inplace=True, kind="mergesort")
                 sheet.reset_index(drop=True, inplace=True)
                 changed.add(_sheet_name(sheets, sheet))
+        elif op_type in {"group_by", "pivot"}:
+            sheet_name = op.get("sheet") or (list(sheets.keys())[0] if sheets else "Sheet1")
+            sheet = sheets.get(sheet_name)
+            keys = op.get("keys") or []
+            columns = (op.get("columns") or []) if op_type == "pivot" else []
+            if sheet is not None and keys and all(col in sheet.columns for col in keys + columns):
+                if op_type == "pivot" and not columns:
+                    raise ValueError("missing_pivot_columns")
+                result = aggregate(
+                    sheet,
+                    keys,
+                    op.get("values"),
+                    op.get("aggs") or ["sum"],
+                    columns,
+                    bool(op.get("categorical_keys")),
+                )
+                target = op.get("to") or ("透视表" if op_type == "pivot" else "汇总")
+                sheets[target] = result
+                _drop_formulas(format_rules, target)
+                changed.add(target)
+        elif op_type == "add_formula":
+            sheet_name = op.get("sheet") or (list(sheets.keys())[0] if sheets else "Sheet1")
+            column_name = op.get("column_name") or op.get("column")
+            formula = op.get("formula")
+            if column_name and formula:
+                formulas.compile_formula(formula)
+                sheet_formulas = formulas.sheet_formulas(format_rules, sheet_name)
+                sheet_formulas[column_name] = formula
+                formulas.recalculation_order(sheet_formulas)
+                _drop_formulas(format_rules, sheet_name, [column_name])
+                format_rules.append({"type": "formula", "sheet": sheet_name, "column": column_name, "formula": formula})
+                sheet = _get_sheet(sheets, op, owned)
+                formulas.recalculate(sheet, sheet_formulas, [column_name])
+                changed.add(sheet_name)
+        elif op_type == "lookup":
+            source_sheets = sheets
+            if op.get("source_workbook"):
+                source_sheets = workbooks(op["source_workbook"]) if workbooks else None
+                if source_sheets is None:
+                    raise ValueError("source_workbook_not_found")
+            sheet_name = op.get("sheet") or (list(sheets.keys())[0] if sheets else "Sheet1")
+            source_name = op.get("source_sheet") or (list(source_sheets.keys())[0] if source_sheets else None)
+            source = source_sheets.get(source_name) if source_name else None
+            if source is None:
+                raise ValueError("source_sheet_not_found")
+            left_on = op.get("left_on") or op.get("on")
+            right_on = op.get("right_on") or op.get("on")
+            sheet = sheets.get(sheet_name)
+            if sheet is not None and left_on in sheet.columns and right_on in source.columns:
+                columns = op.get("columns") or [col for col in source.columns if col != left_on]
+                columns = [col for col in columns if col in source.columns and col != right_on]
+                # A source frame staged earlier in this op list may still change.
+                cacheable = id(source) not in owned
+                hit, values = lookup.lookup(
+                    sheet, source, left_on, right_on, columns, op.get("duplicates") or "first", cacheable
+                )
+                sheet = _get_sheet(sheets, {"sheet": sheet_name}, owned)
+                for col, taken in values.items():
+                    if col in sheet.columns:
+                        # Existing columns are only filled on matched rows.
+                        sheet[col] = _fill_matched(sheet[col], taken, hit)
+                    else:
+                        sheet[col] = taken
+                if op.get("how") == "inner" and not hit.all():
+                    sheet = sheet[hit].reset_index(drop=True)
+                    sheets[sheet_name] = sheet
+                    owned[id(sheet)] = sheet
+                changed.add(sheet_name)
+        if formula_sheet is not None and formula_sheet in sheets:
+            grown = len(sheets[formula_sheet]) > rows_before
+            if _refresh_formulas(sheets, format_rules, formula_sheet, written, grown, owned):
+                changed.add(formula_sheet)
+        elapsed = time.perf_counter() - started
+        metrics.observe("excels_operation_seconds", elapsed, type=str(op_type))
+        metrics.record_timing(f"op.{op_type}", elapsed)
     return sorted(changed), analysis
 
 
-def _get_sheet(sheets: Dict[str, pd.DataFrame], op: Dict[str, Any]) -> pd.DataFrame:
+def aggregate(
+    df: pd.DataFrame,
+    keys: List[str],
+    values: List[str] | None,
+    aggs: List[str],
+    columns: List[str] | None = None,
+    categorical_keys: bool = False,
+) -> pd.DataFrame:
+    # One vectorized groupby over keys (+ pivot columns); pivot columns are
+    # then unstacked into "<value>_<agg>_<column value>" headers.
+    spread = [col for col in columns or [] if col not in keys]
+    group_cols = keys + spread
+    for agg in aggs:
+        if agg not in AGGREGATIONS and not QUANTILE_RE.match(agg):
+            raise ValueError(f"invalid_aggregation:{agg}")
+    if values is None:
+        values = [
+            col
+            for col in df.columns
+            if col not in group_cols and pd.api.types.is_numeric_dtype(df[col].dtype)
+        ]
+    values = [col for col in values if col in df.columns and col not in group_cols]
+
+    data = {}
+    for col in group_cols:
+        key = df[col]
+        if categorical_keys and (key.dtype == object or isinstance(key.dtype, pd.StringDtype)):
+            key = key.astype("category")
+        data[col] = key
+    needs_numbers = any(agg != "count" for agg in aggs)
+    for col in values:
+        numeric = _numeric_values(df[col])
+        # Text would silently aggregate to 0 / NaN; only count may use it.
+        if needs_numbers and numeric is not df[col] and (numeric.isna() & df[col].notna()).any():
+            raise ValueError(f"non_numeric_column:{col}")
+        data[col] = numeric
+    frame = pd.DataFrame(data, copy=False)
+    grouped = frame.groupby(group_cols, sort=False, observed=True, dropna=False)
+
+    if values:
+        parts = {agg: _aggregate(grouped, df, values, agg) for agg in aggs}
+        result = pd.concat(
+            {f"{col}_{agg}": parts[agg][col] for col in values for agg in aggs},
+            axis=1,
+        )
+    else:
+        result = grouped.size().to_frame("count")
+
+    if spread:
+        result = result.unstack(spread)
+        # A key/column pair with no rows has a count of 0, not a blank.
+        count_names = {f"{col}_count" for col in values} if values else {"count"}
+        # By position: a blank pivot value is a NaN label, which label
+        # lookups cannot find.
+        for pos in np.flatnonzero(result.columns.get_level_values(0).isin(count_names)):
+            result.isetitem(pos, result.iloc[:, pos].fillna(0).astype(np.int64))
+        single = len(result.columns.levels[0]) == 1
+        result.columns = [
+            "_".join(str(part) for part in (parts[1:] if single else parts))
+            for parts in result.columns.to_flat_index()
+        ]
+    return result.reset_index()
+
+
+def _aggregate(grouped, df: pd.DataFrame, values: List[str], agg: str) -> pd.DataFrame:
+    if agg == "count":
+        # Count non-empty cells of the original column; text would be NaN
+        # after numeric coercion.
+        ids = grouped.ngroup().to_numpy()
+        index = grouped.size().index
+        return pd.DataFrame(
+            {
+                col: np.bincount(ids, weights=df[col].notna().to_numpy(), minlength=len(index)).astype(np.int64)
+                for col in values
+            },
+            index=index,
+        )
+    selected = grouped[values]
+    if agg == "median":
+        return selected.median()
+    match = QUANTILE_RE.match(agg)
+    if match:
+        return selected.quantile(float(match.group(1)))
+    return selected.agg(agg)
+
+
+def _numeric_values(series: pd.Series) -> pd.Series:
+    # Columns narrowed by compact_dtypes are computed on in 64 bits, so
+    # results neither wrap nor lose float32 precision.
+    dtype = series.dtype
+    if isinstance(dtype, np.dtype) and dtype.kind in "iuf" and dtype.itemsize < 8:
+        return series.astype(np.float64 if dtype.kind == "f" else np.int64)
+    if pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype):
+        return series
+    return pd.to_numeric(series, errors="coerce")
+
+
+def _written_columns(op: Dict[str, Any], sheet: pd.DataFrame | None) -> List[str] | None:
+    # Columns an op writes values into; None when it may touch any column.
+    op_type = op.get("type")
+    if sheet is None:
+        return []
+    if op_type == "set_cell" and op.get("cell"):
+        return [_cell_to_indices(sheet, op["cell"])[1]]
+    if op_type == "set_range" and op.get("range"):
+        return sorted({col for _row, col in _range_to_indices(sheet, op["range"])})
+    if op_type == "add_column":
+        return [op.get("column_name") or op.get("column")]
+    if op_type == "round_column":
+        return [op.get("column")]
+    if op_type == "update_cells":
+        return list((op.get("set") or {}).keys())
+    if op_type == "lookup":
+        return None
+    return []
+
+
+def _refresh_formulas(
+    sheets: Dict[str, pd.DataFrame],
+    format_rules: List[dict],
+    sheet_name: str,
+    written: List[str] | None,
+    grown: bool,
+    owned: Dict[int, pd.DataFrame],
+) -> bool:
+    # Values written straight into a formula column replace the formula, as
+    # typing over a cell does in Excel; everything downstream is recomputed.
+    if written:
+        _drop_formulas(format_rules, sheet_name, written)
+    sheet_formulas = formulas.sheet_formulas(format_rules, sheet_name)
+    if not sheet_formulas:
+        return False
+    dirty = None if written is None or grown else written
+    if dirty is not None and not dirty:
+        return False
+    if not formulas.recalculation_order(sheet_formulas, dirty):
+        return False
+    sheet = _get_sheet(sheets, {"sheet": sheet_name}, owned)
+    formulas.recalculate(sheet, sheet_formulas, dirty)
+    return True
+
+
+def _drop_formulas(format_rules: List[dict], sheet_name: str, columns: Iterable[str] | None = None) -> None:
+    columns = None if columns is None else set(columns)
+    format_rules[:] = [
+        rule
+        for rule in format_rules
+        if not (
+            rule.get("type") == "formula"
+            and rule.get("sheet") == sheet_name
+            and (columns is None or rule.get("column") in columns)
+        )
+    ]
+
+
+def _fill_matched(current: pd.Series, taken: Any, hit: np.ndarray) -> pd.Series:
+    filled = pd.Series(taken, index=current.index)
+    if isinstance(filled.dtype, pd.CategoricalDtype) or isinstance(current.dtype, pd.CategoricalDtype):
+        filled = filled.astype(object)
+        current = current.astype(object)
+    return filled.where(hit, current)
+
+
+def _get_sheet(sheets: Dict[str, pd.DataFrame], op: Dict[str, Any], owned: Dict[int, pd.DataFrame]) -> pd.DataFrame:
+    # Frames passed in are never edited in place: the first write to a sheet
+    # swaps in a shallow copy, so callers can stage edits on dict(sheets).
     name = op.get("sheet") or (list(sheets.keys())[0] if sheets else "Sheet1")
     if name not in sheets:
         sheets[name] = pd.DataFrame()
+    elif id(sheets[name]) not in owned:
+        sheets[name] = sheets[name].copy(deep=False)
+    owned[id(sheets[name])] = sheets[name]
     return sheets[name]
 
 
+def _fit_column(sheet: pd.DataFrame, col: str, value: Any) -> None:
+    # Widen the column when it cannot hold value (compacted dtypes from
+    # compact_dtypes included) instead of relying on pandas' lossy setitem.
+    dtype = sheet[col].dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        if value is None or (_is_scalar(value) and value in dtype.categories):
+            return
+        categories = list(dtype.categories)
+        if isinstance(value, str) and all(isinstance(cat, str) for cat in categories):
+            sheet[col] = sheet[col].cat.set_categories(sorted(categories + [value]))
+        else:
+            sheet[col] = sheet[col].astype(object)
+    elif isinstance(dtype, pd.StringDtype):
+        if value is not None and not isinstance(value, str):
+            sheet[col] = sheet[col].astype(object)
+    elif dtype.kind in "iu":
+        if isinstance(value, (int, np.integer)) and not isinstance(value, bool):
+            info = np.iinfo(dtype)
+            if info.min <= value <= info.max:
+                return
+            sheet[col] = sheet[col].astype(np.int64 if -(2**63) <= value < 2**63 else object)
+        elif value is None or isinstance(value, (float, np.floating)):
+            sheet[col] = sheet[col].astype(np.float64)
+        else:
+            sheet[col] = sheet[col].astype(object)
+    elif dtype.kind == "f":
+        if value is None:
+            return
+        if isinstance(value, (int, float, np.number)) and not isinstance(value, bool):
+            if dtype == np.float32 and not (np.isnan(value) or float(np.float32(value)) == value):
+                sheet[col] = sheet[col].astype(np.float64)
+        else:
+            sheet[col] = sheet[col].astype(object)
+    elif dtype.kind == "b":
+        if not isinstance(value, (bool, np.bool_)):
+            sheet[col] = sheet[col].astype(object)
+    elif dtype.kind == "M":
+        if value is not None and not isinstance(value, (datetime, np.datetime64)):
+            sheet[col] = sheet[col].astype(object)
+
+
+def _is_scalar(value: Any) -> bool:
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
+
+
 def _sheet_name(sheets: Dict[str, pd.DataFrame], df: pd.DataFrame) -> str:
     for name, sheet in sheets.items():
         if sheet is df:
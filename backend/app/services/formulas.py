@@ -0,0 +1,385 @@
+from __future__ import annotations
+
+import ast
+import re
+from functools import lru_cache
+from graphlib import CycleError, TopologicalSorter
+from typing import Any, Callable, Dict, Iterable, List, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+# Formulas use Excel syntax with [Column] in place of same-row cell
+# references, e.g. "=ROUND([Price]*[Qty], 2)".
+TOKEN_RE = re.compile(
+    r'\s*(?:(?P<ref>\[[^\]]+\])|(?P<string>"(?:[^"]|"")*")|(?P<number>\d+(?:\.\d*)?(?:[eE][+-]?\d+)?|\.\d+)'
+    r"|(?P<name>[A-Za-z_][A-Za-z0-9_.]*)|(?P<op><>|<=|>=|[-+*/^&=<>(),%]))"
+)
+CELL_REF_RE = re.compile(r"^([A-Za-z]{1,3})(\d+)$")
+
+OPERATORS = {"=": "==", "<>": "!=", "^": "**", "&": "&", "%": "/100"}
+
+
+def _if(cond, when_true, when_false=False):
+    return np.where(_bool(cond), when_true, when_false)
+
+
+def _round(value, digits=0):
+    value = _numeric(value)
+    return value.round(int(digits)) if isinstance(value, pd.Series) else np.round(value, int(digits))
+
+
+def _elementwise(method: str) -> Callable[..., Any]:
+    def apply(*args):
+        values = [_numeric(arg) for arg in args]
+        lengths = [len(value) for value in values if np.ndim(value)]
+        if not lengths:
+            return getattr(pd.Series(values, dtype=float), method)()
+        frame = pd.DataFrame(
+            {
+                idx: np.asarray(value, dtype=float) if np.ndim(value) else np.full(lengths[0], value, dtype=float)
+                for idx, value in enumerate(values)
+            }
+        )
+        return getattr(frame, method)(axis=1).to_numpy()
+
+    return apply
+
+
+FUNCTIONS: Dict[str, Callable[..., Any]] = {
+    "IF": _if,
+    "ROUND": _round,
+    "ABS": lambda value: np.abs(_numeric(value)),
+    "SQRT": lambda value: np.sqrt(_numeric(value)),
+    "SUM": _elementwise("sum"),
+    "MIN": _elementwise("min"),
+    "MAX": _elementwise("max"),
+    "AVERAGE": _elementwise("mean"),
+    "AND": lambda *args: np.logical_and.reduce([_bool(arg) for arg in args]),
+    "OR": lambda *args: np.logical_or.reduce([_bool(arg) for arg in args]),
+    "NOT": lambda value: np.logical_not(_bool(value)),
+}
+
+_BINARY = {
+    ast.Add: lambda a, b: _numeric(a) + _numeric(b),
+    ast.Sub: lambda a, b: _numeric(a) - _numeric(b),
+    ast.Mult: lambda a, b: _numeric(a) * _numeric(b),
+    ast.Div: lambda a, b: _numeric(a) / _numeric(b),
+    ast.Pow: lambda a, b: _numeric(a) ** _numeric(b),
+    ast.BitAnd: lambda a, b: _text(a) + _text(b),
+}
+
+
+def _compare(op: Callable[[Any, Any], Any]) -> Callable[[Any, Any], Any]:
+    def apply(a, b):
+        # Text against text compares as text, anything against a number as
+        # numbers, so mixed columns never reach Python's str < int.
+        if isinstance(a, str) or isinstance(b, str) or not (_is_number(a) or _is_number(b)):
+            return op(_text(a), _text(b))
+        return op(_numeric(a), _numeric(b))
+
+    return apply
+
+
+_COMPARE = {
+    ast.Eq: _compare(lambda a, b: a == b),
+    ast.NotEq: _compare(lambda a, b: a != b),
+    ast.Lt: _compare(lambda a, b: a < b),
+    ast.LtE: _compare(lambda a, b: a <= b),
+    ast.Gt: _compare(lambda a, b: a > b),
+    ast.GtE: _compare(lambda a, b: a >= b),
+}
+# Explicit parentheses are compiled to calls of this name, so the tree still
+# tells them apart when Excel's ^ precedence is restored.
+_GROUP = "_group"
+
+
+@lru_cache(maxsize=256)
+def compile_formula(formula: str) -> Tuple[ast.Expression, Tuple[str, ...]]:
+    """Parse a formula once into an expression tree and its column references."""
+    text = formula.strip()
+    if text.startswith("="):
+        text = text[1:]
+    refs: List[str] = []
+    parts: List[str] = []
+    for kind, token in _tokens(text):
+        if kind == "ref":
+            name = token[1:-1].strip()
+            if name not in refs:
+                refs.append(name)
+            parts.append(f"_c{refs.index(name)}")
+        elif kind == "string":
+            parts.append(repr(token[1:-1].replace('""', '"')))
+        elif kind == "name":
+            upper = token.upper()
+            if upper in {"TRUE", "FALSE"}:
+                parts.append(upper.title())
+            elif upper in FUNCTIONS:
+                parts.append(upper)
+            else:
+                raise ValueError(f"invalid_formula:{token}")
+        elif kind == "op" and token == "(" and not (parts and parts[-1] in FUNCTIONS):
+            parts.append(f"{_GROUP}(")
+        elif kind == "op":
+            parts.append(OPERATORS.get(token, token))
+        else:
+            parts.append(token)
+    try:
+        tree = ast.parse(" ".join(parts), mode="eval")
+    except SyntaxError:
+        raise ValueError("invalid_formula")
+    _validate(tree)
+    return ast.fix_missing_locations(_ExcelPower().visit(tree)), tuple(refs)
+
+
+def references(formula: str) -> Tuple[str, ...]:
+    return compile_formula(formula)[1]
+
+
+def evaluate(df: pd.DataFrame, formula: str) -> pd.Series:
+    """Evaluate a formula over whole columns of df."""
+    tree, refs = compile_formula(formula)
+    env = {}
+    for idx, name in enumerate(refs):
+        if name not in df.columns:
+            raise ValueError(f"formula_unknown_column:{name}")
+        env[f"_c{idx}"] = df[name]
+    try:
+        # Division by zero and overflow give inf/NaN, as whole-column maths.
+        with np.errstate(all="ignore"):
+            result = _eval(tree.body, env)
+    except (TypeError, ArithmeticError, KeyError) as exc:
+        raise ValueError(f"formula_error:{exc}")
+    if isinstance(result, pd.Series):
+        return result.set_axis(df.index)
+    return pd.Series(np.broadcast_to(result, len(df.index)) if np.ndim(result) else result, index=df.index)
+
+
+def rename_column(formula: str, old: str, new: str) -> str:
+    text = formula.strip()
+    prefix = "=" if text.startswith("=") else ""
+    body = text[len(prefix):]
+    rebuilt = []
+    for kind, token in _tokens(body, keep_space=True):
+        if kind == "ref" and token.strip()[1:-1].strip() == old:
+            token = token.replace(token.strip(), f"[{new}]")
+        rebuilt.append(token)
+    return prefix + "".join(rebuilt)
+
+
+def to_excel(formula: str, letters: Dict[str, str]) -> Callable[[int], str]:
+    """Excel formula for a given row, with [Column] replaced by cell references."""
+    text = formula.strip()
+    body = text[1:] if text.startswith("=") else text
+    parts: List[Tuple[str, str | None]] = []
+    for kind, token in _tokens(body, keep_space=True):
+        if kind == "ref":
+            name = token.strip()[1:-1].strip()
+            parts.append((token[: len(token) - len(token.lstrip())], letters[name]))
+        else:
+            parts.append((token, None))
+
+    def render(row: int) -> str:
+        return "=" + "".join(text if letter is None else f"{text}{letter}{row}" for text, letter in parts)
+
+    return render
+
+
+def from_excel(formula: str, headers: Dict[str, str], row: int) -> str | None:
+    """Turn a same-row Excel formula into [Column] form; None if it is not one."""
+    if not isinstance(formula, str) or not formula.startswith("=") or "!" in formula:
+        return None
+    body = formula[1:].replace("$", "")
+    rebuilt = []
+    try:
+        for kind, token in _tokens(body, keep_space=True):
+            match = CELL_REF_RE.match(token.strip()) if kind == "name" else None
+            if match:
+                letters, ref_row = match.groups()
+                header = headers.get(letters.upper())
+                if header is None or int(ref_row) != row:
+                    return None
+                token = token.replace(token.strip(), f"[{header}]")
+            rebuilt.append(token)
+        converted = "=" + "".join(rebuilt)
+        compile_formula(converted)
+    except ValueError:
+        return None
+    return converted
+
+
+def sheet_formulas(rules: Iterable[dict], sheet: str) -> Dict[str, str]:
+    return {
+        rule["column"]: rule["formula"]
+        for rule in rules
+        if rule.get("type") == "formula" and rule.get("sheet") == sheet
+    }
+
+
+def recalculation_order(formulas: Dict[str, str], dirty: Iterable[str] | None = None) -> List[str]:
+    """Formula columns downstream of dirty (all when None), in dependency order."""
+    graph = {column: set(references(formula)) for column, formula in formulas.items()}
+    try:
+        order = list(TopologicalSorter(graph).static_order())
+    except CycleError:
+        raise ValueError("formula_cycle")
+    order = [column for column in order if column in formulas]
+    if dirty is None:
+        return order
+    stale: Set[str] = set(dirty)
+    result = []
+    for column in order:
+        if column in stale or stale & graph[column]:
+            stale.add(column)
+            result.append(column)
+    return result
+
+
+def recalculate(df: pd.DataFrame, formulas: Dict[str, str], dirty: Iterable[str] | None = None) -> List[str]:
+    """Recompute formula columns of df in place; df must be owned by the caller."""
+    columns = recalculation_order(formulas, dirty)
+    for column in columns:
+        df[column] = evaluate(df, formulas[column])
+    return columns
+
+
+def _tokens(text: str, keep_space: bool = False) -> Iterable[Tuple[str, str]]:
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        match = TOKEN_RE.match(text, pos)
+        if not match or match.end() == pos:
+            raise ValueError("invalid_formula")
+        kind = match.lastgroup
+        yield kind, match.group(0) if keep_space else match.group(kind)
+        pos = match.end()
+
+
+def _validate(tree: ast.AST) -> None:
+    allowed = (
+        ast.Expression,
+        ast.BinOp,
+        ast.UnaryOp,
+        ast.Compare,
+        ast.Call,
+        ast.Name,
+        ast.Constant,
+        ast.Load,
+        ast.USub,
+        ast.UAdd,
+        *_BINARY,
+        *_COMPARE,
+    )
+    for node in ast.walk(tree):
+        if not isinstance(node, allowed):
+            raise ValueError("invalid_formula")
+        if isinstance(node, ast.Compare) and len(node.ops) != 1:
+            raise ValueError("invalid_formula")
+        if isinstance(node, ast.Call) and (
+            not isinstance(node.func, ast.Name)
+            or node.keywords
+            or node.func.id not in FUNCTIONS and not (node.func.id == _GROUP and len(node.args) == 1)
+        ):
+            raise ValueError("invalid_formula")
+
+
+class _ExcelPower(ast.NodeTransformer):
+    """Give ^ Excel's precedence: it binds looser than a leading minus and
+    groups left to right, so -2^2 is 4 and 2^3^2 is 64."""
+
+    def visit_BinOp(self, node: ast.BinOp) -> ast.AST:
+        if not isinstance(node.op, ast.Pow):
+            return self.generic_visit(node)
+        # Python reads a**b**c as a**(b**c); parentheses are _group calls,
+        # so the whole right spine is one Excel chain. A signed tail, as in
+        # a^-b^c, belongs to it too.
+        operands = []
+        current: ast.AST = node
+        while isinstance(current, ast.BinOp) and isinstance(current.op, ast.Pow):
+            operands.append(self.visit(current.left))
+            current = current.right
+        operands.extend(_power_chain(self.visit(current)))
+        result = operands[0]
+        for operand in operands[1:]:
+            result = ast.BinOp(result, ast.Pow(), operand)
+        return result
+
+    def visit_UnaryOp(self, node: ast.UnaryOp) -> ast.AST:
+        return _signed(node.op, self.visit(node.operand))
+
+
+def _power_chain(node: ast.AST) -> List[ast.AST]:
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Pow):
+        return _power_chain(node.left) + [node.right]
+    return [node]
+
+
+def _signed(op: ast.unaryop, node: ast.AST) -> ast.AST:
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Pow):
+        return ast.BinOp(_signed(op, node.left), ast.Pow(), node.right)
+    return ast.UnaryOp(op, node)
+
+
+def _eval(node: ast.AST, env: Dict[str, Any]) -> Any:
+    if isinstance(node, ast.Constant):
+        # Numbers are floats, as in Excel; Python ints would make ^ exact
+        # and unbounded.
+        if isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+            return np.float64(node.value)
+        return node.value
+    if isinstance(node, ast.Name):
+        return env[node.id]
+    if isinstance(node, ast.BinOp):
+        return _BINARY[type(node.op)](_eval(node.left, env), _eval(node.right, env))
+    if isinstance(node, ast.UnaryOp):
+        value = _numeric(_eval(node.operand, env))
+        return -value if isinstance(node.op, ast.USub) else value
+    if isinstance(node, ast.Compare):
+        return _COMPARE[type(node.ops[0])](_eval(node.left, env), _eval(node.comparators[0], env))
+    if isinstance(node, ast.Call) and node.func.id == _GROUP:
+        return _eval(node.args[0], env)
+    if isinstance(node, ast.Call):
+        return FUNCTIONS[node.func.id](*[_eval(arg, env) for arg in node.args])
+    raise ValueError("invalid_formula")
+
+
+def _numeric(value: Any) -> Any:
+    if isinstance(value, pd.Series):
+        if pd.api.types.is_numeric_dtype(value.dtype) and not pd.api.types.is_bool_dtype(value.dtype):
+            return _widen(value)
+        return pd.to_numeric(value, errors="coerce")
+    if isinstance(value, np.ndarray):
+        return _widen(pd.to_numeric(pd.Series(value), errors="coerce")).to_numpy()
+    if isinstance(value, str):
+        return pd.to_numeric(value, errors="coerce")
+    return value
+
+
+def _widen(values: pd.Series) -> pd.Series:
+    # Compacted columns (int8, float32, ...) would wrap or round in their
+    # stored width; compute in 64 bits.
+    dtype = values.dtype
+    if isinstance(dtype, np.dtype) and dtype.kind in "iuf" and dtype.itemsize < 8:
+        return values.astype(np.float64 if dtype.kind == "f" else np.int64)
+    return values
+
+
+def _is_number(value: Any) -> bool:
+    if isinstance(value, (pd.Series, np.ndarray)):
+        return pd.api.types.is_numeric_dtype(value.dtype) and not pd.api.types.is_bool_dtype(value.dtype)
+    return isinstance(value, (int, float, np.number)) and not isinstance(value, (bool, np.bool_))
+
+
+def _text(value: Any) -> Any:
+    if isinstance(value, pd.Series):
+        return value.astype(object).where(value.notna(), "").astype(str)
+    if isinstance(value, np.ndarray):
+        return pd.Series(value).astype(str).to_numpy()
+    return "" if value is None else str(value)
+
+
+def _bool(value: Any) -> Any:
+    if isinstance(value, pd.Series):
+        return value.fillna(False).astype(bool).to_numpy()
+    return value
@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+from pandas.api.extensions import ExtensionDtype, take
+
+from app.services import metrics
+
+
+DEFAULT_CACHE_SIZE = 32
+
+KeyIndex = Tuple[pd.Index, np.ndarray]
+
+_cache: "OrderedDict[Tuple[int, str, str], KeyIndex]" = OrderedDict()
+_cache_lock = threading.Lock()
+_watched: set = set()
+
+
+def key_index(df: pd.DataFrame, column: str, duplicates: str = "first", cache: bool = True) -> KeyIndex:
+    """Hash index over df[column]: unique keys plus the row each maps to.
+
+    Published frames are never edited in place, so an index stays valid for
+    as long as its frame is alive; entries are dropped when the frame is
+    collected. Frames still being staged must pass cache=False.
+    """
+    cache_size = int(os.getenv("LOOKUP_CACHE_SIZE", DEFAULT_CACHE_SIZE))
+    cache = cache and cache_size > 0
+    key = (id(df), column, duplicates)
+    if cache:
+        with _cache_lock:
+            cached = _cache.get(key)
+            if cached is not None:
+                _cache.move_to_end(key)
+        metrics.inc("excels_lookup_index_total", result="hit" if cached is not None else "miss")
+        if cached is not None:
+            return cached
+
+    built = _build_index(df[column], duplicates)
+    if cache:
+        with _cache_lock:
+            if id(df) not in _watched:
+                _watched.add(id(df))
+                weakref.finalize(df, _evict, id(df))
+            _cache[key] = built
+            while len(_cache) > cache_size:
+                _cache.popitem(last=False)
+    return built
+
+
+def lookup(
+    target: pd.DataFrame,
+    source: pd.DataFrame,
+    left_on: str,
+    right_on: str,
+    columns: List[str],
+    duplicates: str = "first",
+    cache: bool = True,
+) -> Tuple[np.ndarray, Dict[str, Any]]:
+    """Match target[left_on] against source[right_on].
+
+    Returns a boolean hit mask over target rows and, for each requested
+    source column, its values aligned to target rows (missing on a miss).
+    """
+    index, positions = key_index(source, right_on, duplicates, cache)
+    found = index.get_indexer(_lookup_keys(target[left_on]))
+    hit = found >= 0
+    rows = np.where(hit, positions[found], -1)
+    values = {}
+    for col in columns:
+        series = source[col]
+        data = series.array if isinstance(series.dtype, ExtensionDtype) else series.to_numpy()
+        values[col] = take(data, rows, allow_fill=True)
+    return hit, values
+
+
+def clear_cache() -> None:
+    with _cache_lock:
+        _cache.clear()
+
+
+def _build_index(keys: pd.Series, duplicates: str) -> KeyIndex:
+    # Blank keys never match, as in VLOOKUP.
+    valid = keys.notna().to_numpy()
+    keep = "last" if duplicates == "last" else "first"
+    repeated = keys.duplicated(keep=keep).to_numpy() & valid
+    if duplicates == "error" and repeated.any():
+        raise ValueError("duplicate_lookup_keys")
+    positions = np.flatnonzero(valid & ~repeated)
+    return pd.Index(_lookup_keys(keys.iloc[positions])), positions
+
+
+def _lookup_keys(keys: pd.Series) -> pd.Index:
+    # Categorical and Arrow-backed keys are matched by value.
+    if isinstance(keys.dtype, (pd.CategoricalDtype, pd.StringDtype)):
+        return pd.Index(keys.to_numpy(dtype=object, na_value=None), dtype=object)
+    return pd.Index(keys)
+
+
+def _evict(frame_id: int) -> None:
+    with _cache_lock:
+        _watched.discard(frame_id)
+        for key in [key for key in _cache if key[0] == frame_id]:
+            del _cache[key]
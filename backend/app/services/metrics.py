@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+import math
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+Sample = Tuple[str, Dict[str, str], float]
+
+_timings: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("server_timings", default=None)
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._meta: Dict[str, Tuple[str, str]] = {}
+        self._counters: Dict[Tuple[str, LabelKey], float] = {}
+        self._histograms: Dict[Tuple[str, LabelKey], List[float]] = {}
+        self._collectors: List[Callable[[], Iterable[Sample]]] = []
+
+    def describe(self, name: str, kind: str, help_text: str) -> None:
+        self._meta[name] = (kind, help_text)
+
+    def inc(self, name: str, value: float = 1.0, **labels: str) -> None:
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        key = (name, _label_key(labels))
+        idx = bisect_left(LATENCY_BUCKETS, value)
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                # per-bucket counts, then +Inf, count and sum
+                hist = self._histograms[key] = [0.0] * (len(LATENCY_BUCKETS) + 3)
+            hist[idx] += 1
+            hist[-2] += 1
+            hist[-1] += value
+
+    def register_collector(self, collector: Callable[[], Iterable[Sample]]) -> None:
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: list(hist) for key, hist in self._histograms.items()}
+        gauges: Dict[Tuple[str, LabelKey], float] = {}
+        for collector in self._collectors:
+            for name, labels, value in collector():
+                gauges[(name, _label_key(labels))] = value
+
+        lines: List[str] = []
+        for name in sorted({key[0] for key in [*counters, *histograms, *gauges]}):
+            kind, help_text = self._meta.get(name, ("untyped", ""))
+            if help_text:
+                lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+            for (metric, labels), value in sorted(gauges.items()):
+                if metric == name:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+            for (metric, labels), hist in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0.0
+                for bound, count in zip([*LATENCY_BUCKETS, math.inf], hist[:-2]):
+                    cumulative += count
+                    le = "+Inf" if bound == math.inf else repr(bound)
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', le),))} {_format_value(cumulative)}")
+                lines.append(f"{name}_count{_format_labels(labels)} {_format_value(hist[-2])}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(hist[-1])}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+REGISTRY.describe("excels_request_seconds", "histogram", "HTTP request latency by route.")
+REGISTRY.describe("excels_stage_seconds", "histogram", "Latency of route stages (parse, apply, commit, preview, ...).")
+REGISTRY.describe("excels_operation_seconds", "histogram", "Latency of single operations inside apply_operations.")
+REGISTRY.describe("excels_commits_total", "counter", "Commits created.")
+REGISTRY.describe("excels_snapshot_bytes_total", "counter", "Shallow bytes of frames newly referenced by commit snapshots.")
+REGISTRY.describe("excels_sessions", "gauge", "Sessions held in memory.")
+REGISTRY.describe("excels_workbooks", "gauge", "Workbooks held in memory.")
+REGISTRY.describe("excels_commits", "gauge", "Commits held in memory.")
+REGISTRY.describe("excels_sheet_bytes", "gauge", "Shallow bytes of distinct sheet frames, live or referenced by history.")
+REGISTRY.describe("excels_llm_seconds", "histogram", "LLM parse request latency by outcome.")
+REGISTRY.describe("excels_llm_cache_total", "counter", "LLM parse cache lookups by result.")
+REGISTRY.describe("excels_spill_bytes_total", "counter", "Bytes of sheet columns written to memory-mapped files.")
+REGISTRY.describe("excels_lookup_index_total", "counter", "Lookup key index cache lookups by result.")
+
+
+def inc(name: str, value: float = 1.0, **labels: str) -> None:
+    REGISTRY.inc(name, value, **labels)
+
+
+def observe(name: str, value: float, **labels: str) -> None:
+    REGISTRY.observe(name, value, **labels)
+
+
+def register_collector(collector: Callable[[], Iterable[Sample]]) -> None:
+    REGISTRY.register_collector(collector)
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        REGISTRY.observe("excels_stage_seconds", elapsed, stage=stage)
+        record_timing(stage, elapsed)
+
+
+def record_timing(name: str, elapsed: float) -> None:
+    timings = _timings.get()
+    if timings is not None:
+        timings.append((name, elapsed))
+
+
+@contextmanager
+def collect_timings() -> Iterator[List[Tuple[str, float]]]:
+    timings: List[Tuple[str, float]] = []
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+
+def server_timing_header(timings: Iterable[Tuple[str, float]]) -> str:
+    totals: Dict[str, float] = {}
+    for name, elapsed in timings:
+        totals[name] = totals.get(name, 0.0) + elapsed
+    return ", ".join(f"{_token(name)};dur={elapsed * 1000:.2f}" for name, elapsed in totals.items())
+
+
+def _label_key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: LabelKey) -> str:
+    if not labels:
+        return ""
+    body = ",".join(f'{key}="{_escape(value)}"' for key, value in labels)
+    return "{" + body + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if math.isfinite(value) and value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+def _token(name: str) -> str:
+    return "".join(char if char.isalnum() or char in "-_." else "_" for char in name)
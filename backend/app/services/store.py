@@ -1,17 +1,60 @@
 from __future__ import annotations
 
+import threading
+from contextlib import contextmanager
 from dataclasses import dataclass, field
 from datetime import datetime, timezone
-from typing import Dict, List, Optional
+from typing import Dict, Iterator, List, Optional
 from uuid import uuid4
 
 import pandas as pd
 
+from app.services import columnar, metrics
+
 
 def _now_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
 
 
+class ReadWriteLock:
+    """Many readers or one writer; waiting writers block new readers."""
+
+    def __init__(self) -> None:
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self) -> Iterator[None]:
+        with self._cond:
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self) -> Iterator[None]:
+        with self._cond:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
 @dataclass
 class Commit:
     id: str
@@ -28,9 +71,16 @@ class WorkbookState:
     sheets: Dict[str, pd.DataFrame]
     format_rules: List[dict] = field(default_factory=list)
     commits: List[Commit] = field(default_factory=list)
+    lock: ReadWriteLock = field(default_factory=ReadWriteLock, repr=False, compare=False)
+
+    @property
+    def head(self) -> Optional[Commit]:
+        return self.commits[-1] if self.commits else None
 
     def snapshot(self) -> Dict[str, pd.DataFrame]:
-        return {name: df.copy(deep=True) for name, df in self.sheets.items()}
+        # Published frames are never edited in place (edits go through
+        # shallow copies), so a snapshot can share them with the live state.
+        return dict(self.sheets)
 
 
 @dataclass
@@ -54,8 +104,14 @@ class InMemoryStore:
             raise KeyError("session_not_found")
         return self.sessions[session_id]
 
-    def add_workbook(self, session: Session, filename: str, sheets: Dict[str, pd.DataFrame]) -> WorkbookState:
-        workbook = WorkbookState(filename=filename, sheets=sheets)
+    def add_workbook(
+        self,
+        session: Session,
+        filename: str,
+        sheets: Dict[str, pd.DataFrame],
+        format_rules: Optional[List[dict]] = None,
+    ) -> WorkbookState:
+        workbook = WorkbookState(filename=filename, sheets=columnar.spill_sheets(sheets), format_rules=format_rules or [])
         session.workbooks[filename] = workbook
         self._commit(workbook, message="init")
         return workbook
@@ -66,34 +122,90 @@ class InMemoryStore:
         return session.workbooks[filename]
 
     def _commit(self, workbook: WorkbookState, message: str, changed_sheets: Optional[List[str]] = None) -> Commit:
-        commit = Commit(
-            id=str(uuid4()),
-            message=message or "update",
-            timestamp=_now_iso(),
-            changed_sheets=changed_sheets or list(workbook.sheets.keys()),
-            snapshot=workbook.snapshot(),
-            format_rules=[rule.copy() for rule in workbook.format_rules],
-        )
-        workbook.commits.append(commit)
+        with metrics.span("commit"):
+            commit = Commit(
+                id=str(uuid4()),
+                message=message or "update",
+                timestamp=_now_iso(),
+                changed_sheets=changed_sheets or list(workbook.sheets.keys()),
+                snapshot=workbook.snapshot(),
+                format_rules=[rule.copy() for rule in workbook.format_rules],
+            )
+            parent = workbook.head.snapshot if workbook.head else {}
+            new_bytes = sum(
+                _frame_bytes(df) for name, df in commit.snapshot.items() if parent.get(name) is not df
+            )
+            workbook.commits.append(commit)
+        metrics.inc("excels_commits_total")
+        metrics.inc("excels_snapshot_bytes_total", new_bytes)
         return commit
 
     def commit(self, workbook: WorkbookState, message: str, changed_sheets: List[str]) -> Commit:
         return self._commit(workbook, message=message, changed_sheets=changed_sheets)
 
+    def publish(
+        self,
+        workbook: WorkbookState,
+        sheets: Dict[str, pd.DataFrame],
+        format_rules: List[dict],
+        message: str,
+        changed_sheets: List[str],
+    ) -> Commit:
+        # Large sheets move onto memory-mapped files here; unchanged sheets
+        # were spilled when first published and stay shared with earlier
+        # snapshots.
+        workbook.sheets = columnar.spill_sheets(sheets, changed_sheets)
+        workbook.format_rules = format_rules
+        return self._commit(workbook, message=message, changed_sheets=changed_sheets)
+
     def history(self, workbook: WorkbookState) -> List[Commit]:
         return list(workbook.commits)
 
-    def rollback(self, workbook: WorkbookState, commit_id: str) -> Commit:
-        target = None
+    def get_commit(self, workbook: WorkbookState, commit_id: str) -> Commit:
         for commit in workbook.commits:
             if commit.id == commit_id:
-                target = commit
-                break
-        if target is None:
-            raise KeyError("commit_not_found")
-        workbook.sheets = {name: df.copy(deep=True) for name, df in target.snapshot.items()}
+                return commit
+        raise KeyError("commit_not_found")
+
+    def rollback(self, workbook: WorkbookState, commit_id: str) -> Commit:
+        target = self.get_commit(workbook, commit_id)
+        workbook.sheets = dict(target.snapshot)
         workbook.format_rules = [rule.copy() for rule in target.format_rules]
         return self._commit(workbook, message=f"rollback:{commit_id}", changed_sheets=list(workbook.sheets.keys()))
 
+    def memory_stats(self) -> Dict[str, float]:
+        sessions = list(self.sessions.values())
+        workbooks = [workbook for session in sessions for workbook in list(session.workbooks.values())]
+        live = {}
+        history = {}
+        for workbook in workbooks:
+            for df in list(workbook.sheets.values()):
+                live[id(df)] = df
+            for commit in list(workbook.commits):
+                for df in commit.snapshot.values():
+                    history[id(df)] = df
+        return {
+            "sessions": len(sessions),
+            "workbooks": len(workbooks),
+            "commits": sum(len(workbook.commits) for workbook in workbooks),
+            "live_bytes": sum(_frame_bytes(df) for df in live.values()),
+            "history_bytes": sum(_frame_bytes(df) for df in history.values()),
+        }
+
+
+def _frame_bytes(df: pd.DataFrame) -> int:
+    # Shallow size: O(columns), cheap enough for the commit path and scrapes.
+    return int(df.memory_usage(index=True, deep=False).sum())
+
+
+def _store_gauges(store: InMemoryStore):
+    stats = store.memory_stats()
+    yield "excels_sessions", {}, stats["sessions"]
+    yield "excels_workbooks", {}, stats["workbooks"]
+    yield "excels_commits", {}, stats["commits"]
+    yield "excels_sheet_bytes", {"state": "live"}, stats["live_bytes"]
+    yield "excels_sheet_bytes", {"state": "history"}, stats["history_bytes"]
+
 
 STORE = InMemoryStore()
+metrics.register_collector(lambda: _store_gauges(STORE))
@@ -1,19 +1,29 @@
 from __future__ import annotations
 
+import copy
 import json
 import os
 import re
-from typing import Any, Dict
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Tuple
 
 import httpx
 from dotenv import load_dotenv
 
+from app.services import metrics
+
 
 load_dotenv()
 
 
 DEFAULT_MODEL = "glm-4.7-flash"
 DEFAULT_BASE_URL = "https://open.bigmodel.cn/api/anthropic"
+DEFAULT_CACHE_SIZE = 0
+
+_cache: "OrderedDict[Tuple[str, str, str, str], Any]" = OrderedDict()
+_cache_lock = threading.Lock()
 
 
 def _extract_json(text: str) -> Dict[str, Any]:
@@ -26,13 +36,54 @@ def _extract_json(text: str) -> Dict[str, Any]:
     return json.loads(match.group(0))
 
 
-def parse_to_operations(message: str, sheet: str | None = None) -> Dict[str, Any]:
+def parse_to_operations(
+    message: str,
+    sheet: str | None = None,
+    validate: Callable[[Dict[str, Any]], Any] | None = None,
+) -> Any:
+    """Ask the LLM for operations; returns validate(parsed) when given.
+
+    With ZHIPU_CACHE_SIZE > 0 results are cached per message, and only
+    once validate has accepted them, so a bad answer is never pinned.
+    """
     api_key = os.getenv("ZHIPU_API_KEY")
     if not api_key:
         raise RuntimeError("missing_api_key")
     model = os.getenv("ZHIPU_MODEL", DEFAULT_MODEL)
     base_url = os.getenv("ZHIPU_BASE_URL", DEFAULT_BASE_URL).rstrip("/")
+    cache_size = int(os.getenv("ZHIPU_CACHE_SIZE", DEFAULT_CACHE_SIZE))
+
+    key = (base_url, model, sheet or "", message)
+    if cache_size > 0:
+        with _cache_lock:
+            cached = _cache.get(key)
+            if cached is not None:
+                _cache.move_to_end(key)
+        metrics.inc("excels_llm_cache_total", result="hit" if cached is not None else "miss")
+        if cached is not None:
+            return copy.deepcopy(cached)
+
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        parsed = _request_operations(api_key, model, base_url, message, sheet)
+        outcome = "ok"
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.observe("excels_llm_seconds", elapsed, outcome=outcome)
+        metrics.record_timing("llm", elapsed)
+    if validate is not None:
+        parsed = validate(parsed)
+
+    if cache_size > 0:
+        with _cache_lock:
+            _cache[key] = copy.deepcopy(parsed)
+            while len(_cache) > cache_size:
+                _cache.popitem(last=False)
+    return parsed
+
 
+def _request_operations(api_key: str, model: str, base_url: str, message: str, sheet: str | None) -> Dict[str, Any]:
     system_prompt = (
         "You are an Excel operation parser. Convert the user request into JSON with keys: "
         "message (string) and operations (array). Each operation must match one of: "
@@ -44,7 +95,17 @@ def parse_to_operations(message: str, sheet: str | None = None) -> Dict[str, Any
         "rename_sheet {type, from, to}; "
         "add_sheet {type, to}; delete_rows {type, sheet, rows}; "
         "update_cells {type, sheet, where:{column,value}, set:{col:value}}; "
-        "sort {type, sheet, by, ascending}. "
+        "sort {type, sheet, by, ascending}; "
+        "group_by {type, sheet, keys, values, aggs, to}; "
+        "pivot {type, sheet, keys, columns, values, aggs, to}. "
+        "aggs items are sum, mean, count, min, max, median or a quantile like q0.9; "
+        "group_by and pivot write the result to a new sheet named by to. "
+        "lookup {type, sheet, source_workbook, source_sheet, on or left_on/right_on, columns, how, duplicates} "
+        "fills columns from another sheet or workbook by matching keys (VLOOKUP); "
+        "how is left or inner, duplicates is first, last or error. "
+        "add_formula {type, sheet, column_name, formula} adds a column computed by an Excel-style formula "
+        "that references columns of the same row as [Column], e.g. =ROUND([Price]*[Qty], 2); "
+        "it supports + - * / ^ & comparisons and IF, ROUND, ABS, SQRT, SUM, MIN, MAX, AVERAGE, AND, OR, NOT. "
         "Only return strict JSON."
     )
     if sheet:
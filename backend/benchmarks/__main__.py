@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+from benchmarks.cases import GROUPS, Workload
+from benchmarks.generators import DTYPE_KINDS
+from benchmarks.runner import build_report, compare, run_cases, write_report
+
+
+PRESETS = {
+    "small": {"rows": 2_000, "cols": 10, "sheets": 1, "load_rows": None},
+    "medium": {"rows": 100_000, "cols": 20, "sheets": 2, "load_rows": 20_000},
+    "large": {"rows": 1_000_000, "cols": 20, "sheets": 1, "load_rows": 50_000},
+}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="small")
+    parser.add_argument("--rows", type=int)
+    parser.add_argument("--cols", type=int)
+    parser.add_argument("--sheets", type=int)
+    parser.add_argument("--load-rows", type=int, help="row cap for xlsx load/export and HTTP cases")
+    parser.add_argument("--mix", default=None, help=f"comma list of {','.join(DTYPE_KINDS)}")
+    parser.add_argument("--groups", default=",".join(GROUPS), help="comma list of ops,pipeline,http")
+    parser.add_argument("--filter", default=None, help="only run cases whose name contains this")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--no-memory", action="store_true")
+    parser.add_argument("--output", type=Path, default=Path("benchmarks/results/latest.json"))
+    parser.add_argument("--baseline", type=Path)
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown ratio before failing")
+    args = parser.parse_args(argv)
+
+    config = dict(PRESETS[args.preset])
+    for key in ("rows", "cols", "sheets", "load_rows"):
+        if getattr(args, key) is not None:
+            config[key] = getattr(args, key)
+    if args.mix:
+        config["mix"] = tuple(kind.strip() for kind in args.mix.split(",") if kind.strip())
+    workload = Workload(**config)
+
+    cases = []
+    for group in args.groups.split(","):
+        group = group.strip()
+        if group not in GROUPS:
+            parser.error(f"unknown group: {group}")
+        cases.extend(GROUPS[group](workload))
+    if args.filter:
+        cases = [case for case in cases if args.filter in case.key]
+
+    results = run_cases(cases, repeat=args.repeat, memory=not args.no_memory)
+    report = build_report(results, {"preset": args.preset, **workload.params})
+    write_report(report, args.output)
+    print(f"wrote {args.output}")
+
+    if args.baseline is None:
+        return 0
+    baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+    rows = compare(report, baseline, args.threshold)
+    regressions = [row for row in rows if row["regression"]]
+    for row in rows:
+        mem = f"{row['memory_ratio']:.2f}x" if row["memory_ratio"] is not None else "-"
+        flag = "  REGRESSION" if row["regression"] else ""
+        print(f"{row['name']:<28} time {row['time_ratio']:.2f}x  memory {mem}{flag}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,310 @@
+from __future__ import annotations
+
+import tempfile
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import cached_property
+from typing import Any, Callable, Dict, Iterator, List, Sequence, get_args
+
+import pandas as pd
+
+from app.models.schemas import Operation
+from app.services import columnar, excel
+from app.services.store import InMemoryStore
+from benchmarks.generators import DEFAULT_MIX, make_workbook, to_csv_bytes, to_xlsx_bytes
+
+
+@dataclass
+class Workload:
+    rows: int
+    cols: int
+    sheets: int = 1
+    mix: Sequence[str] = DEFAULT_MIX
+    load_rows: int | None = None
+    seed: int = 0
+
+    @property
+    def params(self) -> Dict[str, Any]:
+        return {"rows": self.rows, "cols": self.cols, "sheets": self.sheets, "mix": ",".join(self.mix)}
+
+    @cached_property
+    def workbook(self) -> Dict[str, pd.DataFrame]:
+        return make_workbook(self.rows, self.cols, self.sheets, self.mix, self.seed)
+
+    @cached_property
+    def load_workbook(self) -> Dict[str, pd.DataFrame]:
+        if self.load_rows is None or self.load_rows >= self.rows:
+            return self.workbook
+        return {name: df.head(self.load_rows) for name, df in self.workbook.items()}
+
+    @cached_property
+    def xlsx_bytes(self) -> bytes:
+        return to_xlsx_bytes(self.load_workbook)
+
+    @cached_property
+    def csv_bytes(self) -> bytes:
+        return to_csv_bytes(self.workbook[self.sheet])
+
+    @property
+    def sheet(self) -> str:
+        return next(iter(self.workbook))
+
+    def column(self, *kinds: str, nth: int = 0) -> str:
+        matches = [col for col in self.workbook[self.sheet].columns if col.rsplit("_", 1)[0] in kinds]
+        if not matches:
+            raise ValueError(f"workload_has_no_column:{'/'.join(kinds)}")
+        return matches[min(nth, len(matches) - 1)]
+
+
+@dataclass
+class Case:
+    group: str
+    name: str
+    run: Callable[[Any], Any]
+    setup: Callable[[], Any] = lambda: None
+    params: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def key(self) -> str:
+        return f"{self.group}.{self.name}"
+
+
+def _numeric(w: Workload, nth: int = 0) -> str:
+    return w.column("float", "int", nth=nth)
+
+
+def _label(w: Workload) -> str:
+    return w.column("category", "text")
+
+
+OPERATION_CASES: Dict[str, Callable[[Workload], List[dict]]] = {
+    "set_cell": lambda w: [{"type": "set_cell", "sheet": w.sheet, "cell": f"B{max(w.rows // 2, 1)}", "value": 1}],
+    "set_range": lambda w: [{"type": "set_range", "sheet": w.sheet, "range": f"A1:C{min(w.rows, 100)}", "value": 0}],
+    "add_column": lambda w: [{"type": "add_column", "sheet": w.sheet, "column_name": "bench_new", "value": 1}],
+    "swap_columns": lambda w: [{"type": "swap_columns", "sheet": w.sheet, "column_index_a": 0, "column_index_b": 1}],
+    "rename_column": lambda w: [{"type": "rename_column", "sheet": w.sheet, "column": _numeric(w), "new_name": "renamed"}],
+    "round_column": lambda w: [{"type": "round_column", "sheet": w.sheet, "column": _numeric(w), "decimals": 1}],
+    "format_lt": lambda w: [{"type": "format_lt", "sheet": w.sheet, "column": _numeric(w), "threshold": 50}],
+    "t_test": lambda w: [
+        {"type": "t_test", "sheet": w.sheet, "column_a": _numeric(w), "column_b": _numeric(w, 1), "output": "sheet"}
+    ],
+    "rename_sheet": lambda w: [{"type": "rename_sheet", "from": w.sheet, "to": "Renamed"}],
+    "add_sheet": lambda w: [{"type": "add_sheet", "to": "Extra"}],
+    "delete_rows": lambda w: [
+        {"type": "delete_rows", "sheet": w.sheet, "rows": list(range(1, w.rows + 1, 100))}
+    ],
+    "update_cells": lambda w: [
+        {
+            "type": "update_cells",
+            "sheet": w.sheet,
+            "where": {"column": _label(w), "value": "c1"},
+            "set": {_numeric(w): 0},
+        }
+    ],
+    "sort": lambda w: [{"type": "sort", "sheet": w.sheet, "by": _numeric(w), "ascending": False}],
+    "group_by": lambda w: [
+        {
+            "type": "group_by",
+            "sheet": w.sheet,
+            "keys": [_label(w)],
+            "values": [_numeric(w), _numeric(w, 1)],
+            "aggs": ["sum", "mean", "count", "q0.9"],
+            "to": "Grouped",
+        }
+    ],
+    "pivot": lambda w: [
+        {
+            "type": "pivot",
+            "sheet": w.sheet,
+            "keys": [_label(w)],
+            "columns": [w.column("category", nth=1)],
+            "values": [_numeric(w)],
+            "aggs": ["sum"],
+            "to": "Pivot",
+        }
+    ],
+    "lookup": lambda w: [
+        {
+            "type": "lookup",
+            "sheet": w.sheet,
+            "source_sheet": w.sheet,
+            "on": w.column("text"),
+            "columns": [_numeric(w)],
+        }
+    ],
+    "add_formula": lambda w: [
+        {
+            "type": "add_formula",
+            "sheet": w.sheet,
+            "column_name": "bench_formula",
+            "formula": f"=ROUND([{_numeric(w)}]*2+[{_numeric(w, 1)}], 2)",
+        },
+        {"type": "set_cell", "sheet": w.sheet, "cell": "A1", "value": 1},
+    ],
+}
+
+
+def operation_types() -> List[str]:
+    return list(get_args(Operation.model_fields["type"].annotation))
+
+
+def operation_cases(w: Workload) -> List[Case]:
+    missing = [op_type for op_type in operation_types() if op_type not in OPERATION_CASES]
+    if missing:
+        raise RuntimeError(f"missing_benchmark_cases:{','.join(missing)}")
+    cases = []
+    for op_type in operation_types():
+        ops = OPERATION_CASES[op_type](w)
+        cases.append(
+            Case(
+                group="ops",
+                name=op_type,
+                setup=lambda: dict(w.workbook),
+                run=lambda sheets, ops=ops: excel.apply_operations(sheets, ops, []),
+                params=w.params,
+            )
+        )
+    return cases
+
+
+def pipeline_ops(w: Workload) -> List[dict]:
+    return [
+        OPERATION_CASES["set_cell"](w)[0],
+        OPERATION_CASES["update_cells"](w)[0],
+        OPERATION_CASES["round_column"](w)[0],
+        OPERATION_CASES["add_column"](w)[0],
+        OPERATION_CASES["sort"](w)[0],
+    ]
+
+
+def pipeline_cases(w: Workload) -> List[Case]:
+    ops = pipeline_ops(w)
+
+    def commit(store: InMemoryStore):
+        session = store.create_session("bench")
+        workbook = store.add_workbook(session, "bench.xlsx", dict(w.workbook))
+        sheets = dict(workbook.sheets)
+        format_rules: List[dict] = []
+        changed, _analysis = excel.apply_operations(sheets, ops, format_rules)
+        return store.publish(workbook, sheets, format_rules, "bench", changed)
+
+    load_params = {**w.params, "rows": len(w.load_workbook[w.sheet])}
+    cases = [
+        Case("pipeline", "load_xlsx", lambda _: excel.load_excel(w.xlsx_bytes, "bench.xlsx"), params=load_params),
+        Case("pipeline", "load_csv", lambda _: excel.load_excel(w.csv_bytes, "bench.csv"), params=w.params),
+        Case(
+            "pipeline",
+            "load_csv_compact",
+            lambda _: excel.load_excel(w.csv_bytes, "bench.csv", compact=True),
+            params=w.params,
+        ),
+        Case("pipeline", "compact", lambda _: excel.compact_dtypes(w.workbook[w.sheet]), params=w.params),
+        Case(
+            "pipeline",
+            "apply",
+            lambda sheets: excel.apply_operations(sheets, ops, []),
+            setup=lambda: dict(w.workbook),
+            params=w.params,
+        ),
+        Case("pipeline", "commit", commit, setup=InMemoryStore, params=w.params),
+        Case("pipeline", "preview", lambda _: excel.preview(w.workbook[w.sheet], 100), params=w.params),
+        Case("pipeline", "export_csv", lambda _: excel.export_csv(w.workbook), params=w.params),
+        Case("pipeline", "export_xlsx", lambda _: excel.export_xlsx(w.load_workbook, []), params=load_params),
+    ]
+    if columnar.pa is not None:
+        spill_dir = tempfile.gettempdir()
+        mapped = {w.sheet: columnar.spill(w.workbook[w.sheet], spill_dir, 0)}
+        cases += [
+            Case("pipeline", "spill", lambda _: columnar.spill(w.workbook[w.sheet], spill_dir, 0), params=w.params),
+            Case(
+                "pipeline",
+                "apply_mapped",
+                lambda sheets: excel.apply_operations(sheets, ops, []),
+                setup=lambda: dict(mapped),
+                params=w.params,
+            ),
+            Case("pipeline", "preview_mapped", lambda _: excel.preview(mapped[w.sheet], 100), params=w.params),
+        ]
+    return cases
+
+
+@contextmanager
+def stub_llm(result: Dict[str, Any]) -> Iterator[None]:
+    from app.routes import nlp
+
+    original = nlp.parse_to_operations
+    nlp.parse_to_operations = lambda message, sheet=None: result
+    try:
+        yield
+    finally:
+        nlp.parse_to_operations = original
+
+
+def http_cases(w: Workload) -> List[Case]:
+    from fastapi.testclient import TestClient
+
+    from app.main import app
+
+    client = TestClient(app)
+    ops = pipeline_ops(w)
+    params = {**w.params, "rows": len(w.load_workbook[w.sheet])}
+
+    def new_workbook() -> str:
+        session_id = client.post("/sessions", json={"name": "bench"}).json()["id"]
+        _check(
+            client.post(
+                f"/sessions/{session_id}/workbooks/upload",
+                files={"file": ("bench.xlsx", w.xlsx_bytes)},
+            )
+        )
+        return f"/sessions/{session_id}/workbooks/bench.xlsx"
+
+    def upload(_):
+        return new_workbook()
+
+    def operations(base: str):
+        _check(client.post(f"{base}/operations", json={"operations": ops}))
+
+    def dry_run(base: str):
+        _check(client.post(f"{base}/operations", json={"operations": ops, "dry_run": True}))
+
+    def command(base: str):
+        with stub_llm({"message": "bench", "operations": ops}):
+            _check(client.post(f"{base}/command", json={"message": "bench"}))
+
+    def preview(base: str):
+        _check(client.post(f"{base}/preview", json={"limit": 100}))
+
+    def diff(base: str):
+        first = client.post(f"{base}/history").json()["commits"][0]["id"]
+        _check(client.post(f"{base}/diff", json={"base": first}))
+
+    def export(base: str):
+        _check(client.get(f"{base}/export"))
+
+    def edited_workbook() -> str:
+        base = new_workbook()
+        operations(base)
+        return base
+
+    return [
+        Case("http", "upload", upload, params=params),
+        Case("http", "preview", preview, setup=new_workbook, params=params),
+        Case("http", "operations", operations, setup=new_workbook, params=params),
+        Case("http", "dry_run", dry_run, setup=new_workbook, params=params),
+        Case("http", "command", command, setup=new_workbook, params=params),
+        Case("http", "diff", diff, setup=edited_workbook, params=params),
+        Case("http", "export", export, setup=edited_workbook, params=params),
+    ]
+
+
+def _check(resp) -> None:
+    if resp.status_code >= 400:
+        raise RuntimeError(f"http_{resp.status_code}:{resp.text[:200]}")
+
+
+GROUPS: Dict[str, Callable[[Workload], List[Case]]] = {
+    "ops": operation_cases,
+    "pipeline": pipeline_cases,
+    "http": http_cases,
+}
@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+from io import BytesIO
+from typing import Dict, List, Sequence
+
+import numpy as np
+import pandas as pd
+
+
+DTYPE_KINDS = ("int", "float", "category", "text", "date")
+DEFAULT_MIX = ("int", "float", "category", "text", "date")
+
+
+def column_names(cols: int, mix: Sequence[str] = DEFAULT_MIX) -> List[str]:
+    return [f"{mix[idx % len(mix)]}_{idx}" for idx in range(cols)]
+
+
+def make_sheet(
+    rows: int,
+    cols: int,
+    mix: Sequence[str] = DEFAULT_MIX,
+    seed: int = 0,
+    null_ratio: float = 0.05,
+) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    data = {}
+    for name in column_names(cols, mix):
+        kind = name.rsplit("_", 1)[0]
+        data[name] = _make_column(kind, rows, rng, null_ratio)
+    return pd.DataFrame(data)
+
+
+def make_workbook(
+    rows: int,
+    cols: int,
+    sheets: int = 1,
+    mix: Sequence[str] = DEFAULT_MIX,
+    seed: int = 0,
+) -> Dict[str, pd.DataFrame]:
+    return {
+        f"Sheet{idx + 1}": make_sheet(rows, cols, mix, seed=seed + idx)
+        for idx in range(sheets)
+    }
+
+
+def to_xlsx_bytes(sheets: Dict[str, pd.DataFrame]) -> bytes:
+    buffer = BytesIO()
+    with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
+        for name, df in sheets.items():
+            df.to_excel(writer, sheet_name=name, index=False)
+    return buffer.getvalue()
+
+
+def to_csv_bytes(df: pd.DataFrame) -> bytes:
+    return df.to_csv(index=False).encode("utf-8")
+
+
+def _make_column(kind: str, rows: int, rng: np.random.Generator, null_ratio: float):
+    nulls = rng.random(rows) < null_ratio
+    if kind == "int":
+        return rng.integers(0, 1_000_000, rows)
+    if kind == "float":
+        values = rng.normal(100.0, 25.0, rows)
+        values[nulls] = np.nan
+        return values
+    if kind == "category":
+        values = np.array([f"c{idx}" for idx in range(20)], dtype=object)[rng.integers(0, 20, rows)]
+        values[nulls] = None
+        return values
+    if kind == "text":
+        values = np.array([f"row-{idx}-{code:x}" for idx, code in enumerate(rng.integers(0, 1 << 32, rows))], dtype=object)
+        values[nulls] = None
+        return values
+    if kind == "date":
+        return pd.Timestamp("2020-01-01") + pd.to_timedelta(rng.integers(0, 3650, rows), unit="D")
+    raise ValueError(f"unknown_dtype_kind:{kind}")
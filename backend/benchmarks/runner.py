@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import gc
+import json
+import platform
+import statistics
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterable, List
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.cases import Case
+
+
+def measure(case: Case, repeat: int = 5, warmup: int = 1, memory: bool = True) -> Dict[str, Any]:
+    for _ in range(warmup):
+        case.run(case.setup())
+    timings = []
+    for _ in range(repeat):
+        state = case.setup()
+        gc.collect()
+        start = time.perf_counter()
+        case.run(state)
+        timings.append(time.perf_counter() - start)
+    result = {
+        "name": case.key,
+        "group": case.group,
+        "params": case.params,
+        "repeat": repeat,
+        "time_s": {
+            "min": min(timings),
+            "median": statistics.median(timings),
+            "mean": statistics.fmean(timings),
+        },
+        "peak_bytes": None,
+    }
+    if memory:
+        # Separate pass: tracing slows allocation-heavy code, so it never
+        # overlaps the timed runs. Only Python/numpy allocations are seen.
+        state = case.setup()
+        gc.collect()
+        tracemalloc.start()
+        try:
+            case.run(state)
+            result["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def run_cases(cases: Iterable[Case], repeat: int, memory: bool, log=print) -> List[Dict[str, Any]]:
+    results = []
+    for case in cases:
+        result = measure(case, repeat=repeat, memory=memory)
+        peak = result["peak_bytes"]
+        log(
+            f"{case.key:<28} median {result['time_s']['median'] * 1000:10.2f} ms"
+            + (f"   peak {peak / 2**20:9.2f} MiB" if peak is not None else "")
+        )
+        results.append(result)
+    return results
+
+
+def build_report(results: List[Dict[str, Any]], workload: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "workload": workload,
+        },
+        "results": results,
+    }
+
+
+def write_report(report: Dict[str, Any], path: Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(report, indent=2), encoding="utf-8")
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[Dict[str, Any]]:
+    base = {item["name"]: item for item in baseline.get("results", [])}
+    rows = []
+    for item in report["results"]:
+        ref = base.get(item["name"])
+        if ref is None or ref.get("params") != item.get("params"):
+            continue
+        time_ratio = item["time_s"]["median"] / max(ref["time_s"]["median"], 1e-9)
+        mem_ratio = None
+        if item.get("peak_bytes") and ref.get("peak_bytes"):
+            mem_ratio = item["peak_bytes"] / ref["peak_bytes"]
+        rows.append(
+            {
+                "name": item["name"],
+                "time_ratio": time_ratio,
+                "memory_ratio": mem_ratio,
+                "regression": time_ratio > 1 + threshold or (mem_ratio is not None and mem_ratio > 1 + threshold),
+            }
+        )
+    return rows
@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.services.excel import aggregate
+
+
+@pytest.fixture
+def df():
+    return pd.DataFrame(
+        {
+            "r": ["a", "a", "b", "b", None],
+            "m": ["x", None, "x", "y", "x"],
+            "v": [1.0, 2.0, 3.0, np.nan, 5.0],
+            "t": ["p", "q", "p", "p", "q"],
+        }
+    )
+
+
+def _rows(result):
+    return result.astype(object).where(result.notna(), None).to_dict(orient="records")
+
+
+@pytest.mark.parametrize("categorical_keys", [False, True])
+def test_group_by(df, categorical_keys):
+    result = aggregate(df, ["r"], ["v"], ["sum", "count", "max"], categorical_keys=categorical_keys)
+    assert _rows(result) == [
+        {"r": "a", "v_sum": 3.0, "v_count": 2, "v_max": 2.0},
+        {"r": "b", "v_sum": 3.0, "v_count": 1, "v_max": 3.0},
+        {"r": None, "v_sum": 5.0, "v_count": 1, "v_max": 5.0},
+    ]
+
+
+def test_count_counts_text(df):
+    result = aggregate(df, ["r"], ["t"], ["count"])
+    assert result["t_count"].tolist() == [2, 2, 1]
+
+
+def test_default_values_are_numeric_columns(df):
+    result = aggregate(df, ["r"], None, ["sum"])
+    assert list(result.columns) == ["r", "v_sum"]
+
+
+@pytest.mark.parametrize("agg, expected", [("median", [1.5, 3.0, 5.0]), ("q0.5", [1.5, 3.0, 5.0]), ("q1", [2.0, 3.0, 5.0])])
+def test_quantiles(df, agg, expected):
+    result = aggregate(df, ["r"], ["v"], [agg])
+    assert result[f"v_{agg}"].tolist() == expected
+
+
+@pytest.mark.parametrize("categorical_keys", [False, True])
+def test_pivot(df, categorical_keys):
+    result = aggregate(df, ["r"], ["v"], ["sum"], columns=["m"], categorical_keys=categorical_keys)
+    assert list(result.columns) == ["r", "x", "nan", "y"]
+    assert _rows(result)[0] == {"r": "a", "x": 1.0, "nan": 2.0, "y": None}
+
+
+@pytest.mark.parametrize("categorical_keys", [False, True])
+@pytest.mark.parametrize("values", [["v"], None])
+def test_pivot_count_with_blank_column_value(df, values, categorical_keys):
+    result = aggregate(df, ["r"], values, ["count", "sum"], columns=["m"], categorical_keys=categorical_keys)
+    counts = [col for col in result.columns if col.startswith("v_count_")]
+    assert counts == ["v_count_x", "v_count_nan", "v_count_y"]
+    assert result[counts].dtypes.eq(np.int64).all()
+    assert result[counts].to_numpy().tolist() == [[1, 1, 0], [1, 0, 0], [1, 0, 0]]
+
+
+def test_pivot_row_count_without_values(df):
+    result = aggregate(df, ["r"], [], ["count"], columns=["m"])
+    assert result[["x", "nan", "y"]].to_numpy().tolist() == [[1, 1, 0], [1, 0, 1], [1, 0, 0]]
+
+
+@pytest.mark.parametrize("agg", ["sum", "mean", "q0.9"])
+def test_non_numeric_column(df, agg):
+    with pytest.raises(ValueError, match="non_numeric_column:t"):
+        aggregate(df, ["r"], ["t"], [agg])
+
+
+@pytest.mark.parametrize("agg", ["total", "q2", "q-1"])
+def test_invalid_aggregation(df, agg):
+    with pytest.raises(ValueError, match=f"invalid_aggregation:{agg}"):
+        aggregate(df, ["r"], ["v"], [agg])
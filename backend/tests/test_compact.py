@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.services import excel
+
+
+@pytest.fixture
+def df():
+    rows = 400
+    return pd.DataFrame(
+        {
+            "k": ["a", "b"] * (rows // 2),
+            "q": np.tile([100, 120], rows // 2),
+            "p": np.tile([100, 3], rows // 2),
+            "f": np.tile([16777215.0, 0.25], rows // 2),
+            "id": [f"row-{idx}" for idx in range(rows)],
+            "half": [f"h{idx % (rows // 2)}" for idx in range(rows)],
+        }
+    )
+
+
+def test_compact_dtypes(df):
+    compact = excel.compact_dtypes(df)
+    assert compact["q"].dtype == np.int8
+    assert compact["f"].dtype == np.float32
+    assert isinstance(compact["k"].dtype, pd.CategoricalDtype)
+    # Half the values distinct is not low cardinality.
+    assert not isinstance(compact["half"].dtype, pd.CategoricalDtype)
+    assert not isinstance(compact["id"].dtype, pd.CategoricalDtype)
+
+
+@pytest.mark.parametrize(
+    "ops",
+    [
+        [{"type": "add_formula", "sheet": "S", "column": "t", "formula": "=[q]*[p]+[f]*[f]"}],
+        [{"type": "group_by", "sheet": "S", "keys": ["k"], "values": ["q", "f"], "aggs": ["sum", "mean"]}],
+        [{"type": "pivot", "sheet": "S", "keys": ["k"], "columns": ["p"], "values": ["f"], "aggs": ["sum"]}],
+        [{"type": "round_column", "sheet": "S", "column": "f", "decimals": 1}],
+        [{"type": "set_cell", "sheet": "S", "cell": "B2", "value": 1000}],
+    ],
+)
+def test_operations_are_unaffected_by_compaction(df, ops):
+    plain = {"S": df}
+    compact = {"S": excel.compact_dtypes(df)}
+    excel.apply_operations(plain, ops, [])
+    excel.apply_operations(compact, ops, [])
+    assert plain.keys() == compact.keys()
+    for name in plain:
+        pd.testing.assert_frame_equal(
+            compact[name], plain[name], check_dtype=False, check_categorical=False, check_exact=True
+        )
@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import app.services  # noqa: F401  (enables copy-on-write)
+from app.services.diff import diff_sheets
+
+
+@pytest.fixture
+def sheet():
+    return pd.DataFrame({"a": np.arange(200), "s": ["x"] * 200})
+
+
+def _edit(df, row, col, value):
+    edited = df.copy(deep=False)
+    edited.loc[row, col] = value
+    return edited
+
+
+def test_shared_sheets_are_skipped(sheet):
+    assert diff_sheets({"S": sheet}, {"S": sheet.copy(deep=False)}, 100) == []
+
+
+def test_change_outside_the_page_is_reported(sheet):
+    [entry] = diff_sheets({"S": sheet}, {"S": _edit(sheet, 149, "a", -1)}, 100)
+    assert entry["total_rows"] == 1
+    assert entry["cells"] == [{"row": 150, "column": "a", "before": 149, "after": -1}]
+
+
+def test_pages_run_over_changed_then_added_rows(sheet):
+    edited = _edit(_edit(sheet, 9, "s", "y"), 149, "a", -1)
+    grown = pd.concat([edited, pd.DataFrame({"a": [7, 8], "s": ["p", "q"]})], ignore_index=True)
+    pages = [diff_sheets({"S": sheet}, {"S": grown}, 2, offset)[0] for offset in (0, 2, 4)]
+    assert [page["changed_rows"] for page in pages] == [[10, 150], [], []]
+    assert [page["added_rows"] for page in pages] == [[], [201, 202], []]
+    assert [page["has_more"] for page in pages] == [True, False, False]
+    assert {page["total_rows"] for page in pages} == {4}
+
+
+def test_removed_rows(sheet):
+    [entry] = diff_sheets({"S": sheet}, {"S": sheet.iloc[:198]}, 100)
+    assert entry["removed_rows"] == [199, 200]
+    assert entry["changed_rows"] == []
+
+
+def test_missing_values_compare_equal():
+    old = pd.DataFrame({"f": [1.0, np.nan], "d": pd.to_datetime(["2020-01-01", None]), "o": [None, 1]})
+    new = old.copy(deep=False)
+    new["f"] = old["f"].copy()
+    new["d"] = old["d"].copy()
+    new["o"] = [np.nan, 1.0]
+    assert diff_sheets({"S": old}, {"S": new}, 100) == []
+
+
+def test_moved_columns(sheet):
+    [entry] = diff_sheets({"S": sheet}, {"S": sheet[["s", "a"]]}, 100)
+    assert entry["moved_columns"] == ["s", "a"]
+    assert entry["cells"] == []
+
+
+def test_datetime_cells_keep_their_type():
+    old = pd.DataFrame({"d": pd.to_datetime(["2020-01-01", "2020-01-02"])})
+    new = old.copy(deep=False)
+    new["d"] = pd.Series(["2021-05-05", pd.Timestamp("2020-01-02")], dtype=object)
+    [entry] = diff_sheets({"S": old}, {"S": new}, 100)
+    assert entry["cells"] == [{"row": 1, "column": "d", "before": pd.Timestamp("2020-01-01"), "after": "2021-05-05"}]
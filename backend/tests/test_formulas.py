@@ -0,0 +1,180 @@
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+import pytest
+from openpyxl import Workbook
+
+from app.services import excel, formulas
+
+
+@pytest.fixture
+def df():
+    return pd.DataFrame(
+        {
+            "A": [1, 2, 3],
+            "B": [4.0, np.nan, 0.5],
+            "Name": ["x", "y", None],
+            "Score": [60, "n/a", 40],
+        }
+    )
+
+
+@pytest.mark.parametrize(
+    "formula, refs",
+    [
+        ("=[A]+[B]*2", ("A", "B")),
+        ("=ROUND([ A ]*[A], 2)", ("A",)),
+        ('="[A]"&[Name]', ("Name",)),
+        ("=if([A]>1, true, false)", ("A",)),
+    ],
+)
+def test_references(formula, refs):
+    assert formulas.references(formula) == refs
+
+
+@pytest.mark.parametrize(
+    "formula",
+    [
+        "=[A]+",
+        "=FOO([A])",
+        "=[A](1)",
+        "=TRUE(1)",
+        "=1<[A]<3",
+        "=[A].real",
+        "=__import__",
+        "=[A] @",
+    ],
+)
+def test_invalid_formulas(formula):
+    with pytest.raises(ValueError, match="invalid_formula"):
+        formulas.compile_formula(formula)
+
+
+@pytest.mark.parametrize(
+    "formula, expected",
+    [
+        ("=[A]*2", [2.0, 4.0, 6.0]),
+        ("=[A]+[B]", [5.0, np.nan, 3.5]),
+        ("=1/0", [np.inf] * 3),
+        ("=[A]/([A]-2)", [-1.0, np.inf, 3.0]),
+        ("=-2^2", [4.0] * 3),
+        ("=-(2^2)", [-4.0] * 3),
+        ("=2^3^2", [64.0] * 3),
+        ("=2^(3^2)", [512.0] * 3),
+        ("=2*-3^2", [18.0] * 3),
+        ("=-[A]^2", [1.0, 4.0, 9.0]),
+        ("=9^9^9", [387420489.0**9] * 3),
+        ("=10^400", [np.inf] * 3),
+        ("=50%", [0.5] * 3),
+        ("=ROUND([B]/3, 1)", [1.3, np.nan, 0.2]),
+        ("=SUM([A], [B], 1)", [6.0, 3.0, 4.5]),
+        ("=[Score]>50", [True, False, False]),
+        ('=[Name]="x"', [True, False, False]),
+        ("=[A]<>[B]", [True, True, True]),
+        ('=IF([A]>1, "big", "small")', ["small", "big", "big"]),
+        ('=[Name]&"-"&[A]', ["x-1", "y-2", "-3"]),
+        ("=AND([A]>1, [A]<3)", [False, True, False]),
+    ],
+)
+def test_evaluate(df, formula, expected):
+    result = formulas.evaluate(df, formula)
+    assert result.index.equals(df.index)
+    if result.dtype.kind == "f":
+        expected = pytest.approx(expected, nan_ok=True)
+    assert result.tolist() == expected
+
+
+@pytest.mark.parametrize(
+    "formula, error",
+    [
+        ("=[Missing]+1", "formula_unknown_column:Missing"),
+        ("=ROUND([A], [A])", "formula_error"),
+        ("=SQRT()", "formula_error"),
+        ("=NOT([A], [B])", "formula_error"),
+    ],
+)
+def test_evaluate_errors(df, formula, error):
+    with pytest.raises(ValueError, match=error):
+        formulas.evaluate(df, formula)
+
+
+def test_recalculation_order():
+    rules = {"C": "=[B]+1", "B": "=[A]*2", "D": "=[A]"}
+    assert formulas.recalculation_order(rules, dirty=["B"]) == ["B", "C"]
+    assert set(formulas.recalculation_order(rules)) == {"B", "C", "D"}
+    with pytest.raises(ValueError, match="formula_cycle"):
+        formulas.recalculation_order({"A": "=[B]", "B": "=[A]"})
+
+
+@pytest.mark.parametrize(
+    "cell, expected",
+    [
+        ("=A2*$B$2", "=[a]*[b]"),
+        ("=A2*B3", None),
+        ("=Sheet2!A2", None),
+        ("=VLOOKUP(A2, C:D, 2)", None),
+    ],
+)
+def test_from_excel(cell, expected):
+    assert formulas.from_excel(cell, {"A": "a", "B": "b"}, 2) == expected
+
+
+def test_to_excel_round_trip():
+    render = formulas.to_excel("=[a]* [b]", {"a": "A", "b": "B"})
+    assert render(7) == "=A7* B7"
+    assert formulas.from_excel(render(7), {"A": "a", "B": "b"}, 7) == "=[a]* [b]"
+
+
+def _workbook(*rows) -> bytes:
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "S"
+    for row in rows:
+        ws.append(row)
+    buffer = BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+
+def test_load_formulas_recomputes_columns():
+    data = _workbook(["a", "b", "c"], [1, "=A2*2", "=B2+1"], [2, "=A3*2", "=B3+1"])
+    sheets = excel.load_excel(data, "t.xlsx")
+    rules = excel.load_formulas(data, sheets, "t.xlsx")
+    assert {rule["column"]: rule["formula"] for rule in rules} == {"b": "=[a]*2", "c": "=[b]+1"}
+    assert sheets["S"]["c"].tolist() == [3.0, 5.0]
+
+
+def test_load_formulas_skips_columns_it_cannot_evaluate():
+    data = _workbook(
+        ["a", "b", "c", "d"],
+        [1, "=ROUND(A2,A2)", "=A2+1", "=A2*2"],
+        [2, "=ROUND(A3,A3)", "=A3+1", "=A3"],
+    )
+    sheets = excel.load_excel(data, "t.xlsx")
+    cached = sheets["S"]["b"].copy()
+    rules = excel.load_formulas(data, sheets, "t.xlsx")
+    assert [rule["column"] for rule in rules] == ["c"]
+    assert sheets["S"]["b"].equals(cached)
+    assert sheets["S"]["c"].tolist() == [2.0, 3.0]
+
+
+@pytest.mark.parametrize(
+    "formula, expected",
+    [
+        ("=[q]*[p]", [10000, 360]),
+        ("=[f]*[f]", [16785409.0, 1.0]),
+        ("=IF([q]>0, [q], [p])*[p]", [10000, 360]),
+        ("=-[u]", [-200, -1]),
+    ],
+)
+def test_evaluate_compacted_columns(formula, expected):
+    df = pd.DataFrame(
+        {
+            "q": np.array([100, 120], dtype=np.int8),
+            "p": np.array([100, 3], dtype=np.int8),
+            "u": np.array([200, 1], dtype=np.uint8),
+            "f": np.array([4097, 1], dtype=np.float32),
+        }
+    )
+    assert formulas.evaluate(df, formula).tolist() == expected
@@ -0,0 +1,43 @@
+import pytest
+from fastapi import HTTPException
+
+from app.routes import nlp
+from app.services import zhipu
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    answers = [
+        {"message": "bad", "operations": [{"type": "bogus"}]},
+        {"message": "ok", "operations": [{"type": "sort", "by": "a"}]},
+    ]
+    calls = []
+
+    def request(*args):
+        calls.append(args)
+        return dict(answers[min(len(calls), len(answers)) - 1])
+
+    monkeypatch.setenv("ZHIPU_API_KEY", "test")
+    monkeypatch.setattr(zhipu, "_request_operations", request)
+    zhipu._cache.clear()
+    yield calls
+    zhipu._cache.clear()
+
+
+def _parse():
+    try:
+        return nlp.parse_request("sort by a").message
+    except HTTPException as exc:
+        return exc.detail
+
+
+def test_cache_is_off_by_default(llm, monkeypatch):
+    monkeypatch.delenv("ZHIPU_CACHE_SIZE", raising=False)
+    assert [_parse() for _ in range(3)] == ["parse_failed", "ok", "ok"]
+    assert len(llm) == 3
+
+
+def test_invalid_answers_are_not_cached(llm, monkeypatch):
+    monkeypatch.setenv("ZHIPU_CACHE_SIZE", "8")
+    assert [_parse() for _ in range(3)] == ["parse_failed", "ok", "ok"]
+    assert len(llm) == 2